@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import sys
+import time
+import coders
+import instrument
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Поддерживаемые методы. Raw встраивает сообщение прямо в исходный
+# файл, поэтому в пакетном режиме не используется
+METHODS = sorted(method for method in coders.CODERS if method != "raw")
+
+# Состояние процесса-исполнителя: класс кодера и сообщение
+# загружаются один раз при его запуске
+_state = {}
+
+
+def _init_worker(method: str, message_file: str = None,
+                 metrics: bool = False) -> None:
+    """
+    Инициализирует процесс-исполнитель: импортирует модуль
+    метода (а вместе с ним jpegio или PIL) и считывает сообщение.
+    Если metrics истинен, включает сбор статистики.
+    """
+    # Статистика и профиль, унаследованные от основного
+    # процесса при fork, учитывались бы дважды
+    instrument.reset()
+
+    if metrics:
+        instrument.enable()
+
+    _state["method"] = method
+    _state["coder"] = coders.load(method)
+    _state["message"] = None
+
+    if message_file is not None:
+        with open(message_file, "rb") as f:
+            _state["message"] = f.read()
+
+
+def _embed(file_name: str, out_dir: str) -> dict:
+    """
+    Встраивает сообщение в контейнер file_name и сохраняет
+    результат в каталог out_dir. Возвращает статистику.
+    """
+    coder, message = _state["coder"], _state["message"]
+    out = os.path.join(out_dir, os.path.basename(file_name))
+    timings = {}
+
+    start = time.perf_counter()
+    stego = coder(file_name, message)
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    positions = coders.encode_framed(_state["method"], stego)
+    # BMYY запоминает емкость, найденную при встраивании,
+    # и не просматривает контейнер второй раз
+    capacity = stego.capacity()
+    timings["encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stego.save_as(out)
+
+    # Метод BMYY возвращает позиции блоков, они нужны для извлечения
+    if positions is not None:
+        with open(out + ".positions", "wb") as f:
+            f.write(positions)
+
+    timings["write"] = time.perf_counter() - start
+    return {"capacity": capacity, "bits": 8 * len(message),
+            "output": out, "timings": timings}
+
+
+def _extract(file_name: str, out_dir: str) -> dict:
+    """
+    Извлекает сообщение из контейнера file_name и сохраняет
+    его в каталог out_dir. Возвращает статистику.
+    """
+    coder = _state["coder"]
+    out = os.path.join(out_dir, os.path.basename(file_name) + ".bin")
+    timings = {}
+
+    start = time.perf_counter()
+    stego = coder(file_name)
+    timings["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    positions = None
+
+    if coders.positional(_state["method"]):
+        with open(file_name + ".positions", "rb") as f:
+            positions = f.read()
+
+    message = coders.decode_framed(_state["method"], stego, positions)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+
+    with open(out, "wb") as f:
+        f.write(message)
+
+    timings["write"] = time.perf_counter() - start
+    return {"bits": 8 * len(message), "output": out, "timings": timings}
+
+
+def _process(action: str, file_name: str, out_dir: str) -> tuple:
+    """
+    Обрабатывает один файл в процессе-исполнителе.
+    Ошибки не прерывают пакет, а попадают в результат.
+    Возвращает результат и статистику instrument по файлу.
+    """
+    start = time.perf_counter()
+
+    try:
+        result = (_embed if action == "embed" else _extract)(
+            file_name, out_dir)
+
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+
+    result["file"] = file_name
+    result["total"] = time.perf_counter() - start
+    return result, instrument.drain()
+
+
+def collect(source: str, method: str) -> list:
+    """
+    Возвращает список контейнеров: файлы каталога source с
+    расширением метода или строки файла-манифеста source.
+    """
+    if os.path.isdir(source):
+        extensions = coders.extensions(method)
+        return sorted(os.path.join(source, name)
+                      for name in os.listdir(source)
+                      if name.lower().endswith(extensions))
+
+    with open(source) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run(action: str, method: str, files: list, out_dir: str,
+        message_file: str = None, workers: int = None,
+        max_in_flight: int = None, metrics: bool = False) -> list:
+    """
+    Обрабатывает файлы пулом процессов и возвращает
+    статистику по каждому файлу в порядке завершения.
+    Одновременно в работе не более max_in_flight файлов.
+    Если metrics истинен, статистика instrument исполнителей
+    добавляется к статистике основного процесса.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    results = []
+    pending = set()
+    files = iter(files)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(method, message_file,
+                                       metrics)) as pool:
+        while True:
+            # Дополняем очередь до границы, не загружая
+            # в память задачи для всего пакета сразу
+            for file_name in files:
+                pending.add(pool.submit(_process, action, file_name,
+                                        out_dir))
+
+                if len(pending) >= max_in_flight:
+                    break
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                result, stats = future.result()
+                instrument.merge(stats)
+                results.append(result)
+
+    return results
+
+
+def main() -> None:
+    """
+    Пакетно встраивает или извлекает сообщения
+    для каталога или манифеста изображений.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("action", choices=("embed", "extract"))
+    parser.add_argument("method", choices=METHODS)
+    parser.add_argument("source", help="каталог или файл-манифест")
+    parser.add_argument("--out", required=True, help="каталог результатов")
+    parser.add_argument("--message", help="файл сообщения для embed")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-in-flight", type=int)
+    parser.add_argument("--results", help="файл JSON со статистикой")
+    parser.add_argument("--metrics", choices=("json", "prometheus"),
+                        help="вывести статистику instrument в stderr")
+    args = parser.parse_args()
+
+    if args.action == "embed" and args.message is None:
+        parser.error("для embed требуется --message")
+
+    start = time.perf_counter()
+    results = run(args.action, args.method,
+                  collect(args.source, args.method), args.out,
+                  args.message, args.workers, args.max_in_flight,
+                  args.metrics is not None)
+    elapsed = time.perf_counter() - start
+    failed = sum("error" in result for result in results)
+    print(f"{len(results)} files, {failed} failed, {elapsed:.2f} s")
+
+    if args.results is not None:
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.metrics is not None:
+        sys.stderr.write(instrument.export(args.metrics))
+        sys.stderr.write(instrument.profile())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import coders
+import frame
+
+# Размеры синтетических контейнеров: высота и ширина
+SIZES = {
+    "256": (256, 256),
+    "512": (512, 512),
+    "1k": (1024, 1024),
+    "2k": (2048, 2048),
+    "4k": (2160, 3840),
+    "8k": (4320, 7680),
+}
+
+# Размеры сообщений: в байтах или в процентах от емкости
+MESSAGES = ("16", "1%", "10%", "100%")
+
+# Измеряемые кодеры и формат их контейнеров: методы coders.CODERS
+# для PNG и JPEG. Raw изменяет сам исходный файл и не измеряется
+CODERS = {method: coders.extensions(method)[0].lstrip(".")
+          for method in coders.CODERS
+          if coders.extensions(method)[0] in (".png", ".jpg")}
+
+
+def make_container(h: int, w: int, seed: int = 0) -> np.array:
+    """
+    Возвращает синтетическое RGB изображение h x w: плавный
+    градиент с шумом, похожий на фотографию по статистике
+    младших бит и по числу подходящих для BMYY блоков.
+    """
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, w, dtype=np.float32)[None, :]
+    base = 112 + 96 * np.sin(6 * x + 3 * y) * np.cos(4 * y)
+    image = np.empty((h, w, 3), dtype=np.uint8)
+
+    for c in range(3):
+        noise = rng.normal(0, 2, (h, w)).astype(np.float32)
+        image[..., c] = np.clip(base + 16 * c + noise, 0, 255)
+
+    return image
+
+
+def _peak_rss() -> int:
+    """
+    Возвращает пиковый размер резидентной памяти процесса в КБ.
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS значение в байтах, в Linux - в килобайтах
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _timed(f, repeat: int):
+    """
+    Вызывает f repeat раз и возвращает лучшее время и результат.
+    """
+    best, result = float("inf"), None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def _run_coder(coder: str, path: str, spec: str, repeat: int,
+               out_dir: str) -> list:
+    """
+    Измеряет открытие, встраивание, сохранение и извлечение
+    для кодера coder на контейнере path. Выполняется в
+    отдельном процессе, чтобы пиковая память не смешивалась.
+    """
+    cls, ext = coders.load(coder), CODERS[coder]
+    t_open, stego = _timed(lambda: cls(path), repeat)
+    capacity = stego.capacity()
+    n_bytes = frame.message_size(spec, capacity)
+
+    # В контейнер не помещается даже заголовок
+    if n_bytes == 0:
+        return []
+
+    message = np.random.default_rng(1).bytes(n_bytes)
+    records = [{"op": "open", "seconds": t_open}]
+
+    def encode():
+        # Кодируем заново открытый контейнер, чтобы
+        # повторы не накладывались друг на друга
+        s = cls(path, message)
+        start = time.perf_counter()
+        positions = s.encode_framed()
+        return time.perf_counter() - start, s, positions
+
+    t_encode = float("inf")
+
+    for _ in range(repeat):
+        elapsed, stego, positions = encode()
+        t_encode = min(t_encode, elapsed)
+
+    records.append({"op": "encode", "seconds": t_encode})
+    out = os.path.join(out_dir, f"{coder}-{os.getpid()}.{ext}")
+    t_save, _ = _timed(lambda: stego.save_as(out), repeat)
+    records.append({"op": "save", "seconds": t_save})
+
+    if positions is None:
+        t_decode, decoded = _timed(stego.decode_framed, repeat)
+
+    else:
+        t_decode, decoded = _timed(
+            lambda: stego.decode_framed(positions), repeat)
+
+    records.append({"op": "decode", "seconds": t_decode})
+    os.remove(out)
+
+    if decoded != message:
+        raise RuntimeError(f"{coder}: сообщение не совпадает")
+
+    for record in records:
+        record.update(case=coder, capacity=capacity, message=n_bytes)
+        record["mb_per_s"] = n_bytes / record["seconds"] / 1e6
+
+    return records
+
+
+def _run_attacks(png_path: str, jpg_path: str, repeat: int) -> list:
+    """
+    Измеряет атаку хи-квадрат, ее последовательный вариант
+    и статистику корреляции младших бит.
+    """
+    import chi
+    import lsb_correlation
+    from PIL import Image
+
+    image = np.array(Image.open(png_path))
+    mb = image.size / 1e6
+    records = []
+
+    t, _ = _timed(lambda: chi.chi_attack(jpg_path), repeat)
+    records.append({"case": "chi", "op": "chi_attack", "seconds": t})
+    t, _ = _timed(lambda: chi.chi_curve(jpg_path, 100), repeat)
+    records.append({"case": "chi", "op": "chi_curve", "seconds": t})
+    t, _ = _timed(lambda: lsb_correlation.frequencies(
+        lsb_correlation.lsb_comparison(image)), repeat)
+    records.append({"case": "correlation", "op": "stat", "seconds": t})
+    t, _ = _timed(lambda: lsb_correlation.lsb_rates(image), repeat)
+    records.append({"case": "correlation", "op": "rates", "seconds": t})
+
+    for record in records:
+        record["mb_per_s"] = mb / record["seconds"]
+
+    return records
+
+
+def _isolated(f, *args) -> list:
+    """
+    Выполняет f(*args) в новом процессе и добавляет
+    к результатам пиковую память этого процесса.
+    """
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        records, peak = pool.apply(_with_peak, (f,) + args)
+
+    for record in records:
+        record["peak_rss_kb"] = peak
+
+    return records
+
+
+def _with_peak(f, *args) -> tuple:
+    """
+    Возвращает результат f(*args) и пиковую память процесса.
+    """
+    return f(*args), _peak_rss()
+
+
+def run(sizes: list, messages: list, coders: list, repeat: int = 3,
+        attacks: bool = True) -> list:
+    """
+    Запускает измерения и возвращает список записей.
+    """
+    from PIL import Image
+
+    records = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            h, w = SIZES[size]
+            # Готовим контейнеры заранее, их создание не измеряется
+            image = make_container(h, w)
+            png_path = os.path.join(tmp, f"{size}.png")
+            jpg_path = os.path.join(tmp, f"{size}.jpg")
+            Image.fromarray(image).save(png_path, compress_level=1)
+            Image.fromarray(image).save(jpg_path, quality=90)
+            paths = {"png": png_path, "jpg": jpg_path}
+            del image
+            blocks = (h // 8) * (w // 8)
+
+            for coder in coders:
+                for spec in messages:
+                    path = paths[CODERS[coder]]
+                    result = _isolated(_run_coder, coder, path, spec,
+                                       repeat, tmp)
+
+                    for record in result:
+                        record["spec"] = spec
+
+                        if coder == "bmyy":
+                            record["blocks_per_s"] = (blocks /
+                                                      record["seconds"])
+
+                    records += result
+
+            if attacks:
+                records += _isolated(_run_attacks, png_path, jpg_path, repeat)
+
+            for record in records:
+                record.setdefault("size", size)
+
+    return records
+
+
+def compare(old: list, new: list, tolerance: float = 0.2) -> list:
+    """
+    Сравнивает два набора измерений и возвращает записи,
+    замедлившиеся более чем на tolerance.
+    """
+    def key(record):
+        return (record["case"], record["op"], record["size"],
+                record.get("spec"))
+
+    baseline = {key(record): record["seconds"] for record in old}
+    return [dict(record, before=baseline[key(record)])
+            for record in new if key(record) in baseline
+            and record["seconds"] > (1 + tolerance) * baseline[key(record)]]
+
+
+def main() -> None:
+    """
+    Измеряет производительность кодеров и атак
+    на синтетических контейнерах разного размера.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--sizes", default=",".join(SIZES),
+                        help="размеры через запятую: " + ", ".join(SIZES))
+    parser.add_argument("--messages", default=",".join(MESSAGES),
+                        help="размеры сообщений: байты или проценты")
+    parser.add_argument("--coders", default=",".join(CODERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-attacks", action="store_true")
+    parser.add_argument("--out", help="файл JSON с результатами")
+    parser.add_argument("--compare", help="файл JSON прошлого запуска")
+    args = parser.parse_args()
+
+    records = run(args.sizes.split(","), args.messages.split(","),
+                  args.coders.split(","), args.repeat, not args.no_attacks)
+
+    for r in records:
+        print(f"{r['case']:>12} {r['op']:>10} {r['size']:>4} "
+              f"{r.get('spec', ''):>5} {r['seconds'] * 1e3:10.2f} ms "
+              f"{r['mb_per_s']:10.2f} MB/s {r['peak_rss_kb'] / 1024:8.1f} MB")
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "machine": platform.machine(),
+                       "records": records}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            slower = compare(json.load(f)["records"], records)
+
+        for r in slower:
+            print(f"slower: {r['case']} {r['op']} {r['size']} "
+                  f"{r.get('spec', '')} {r['before']:.4f} -> "
+                  f"{r['seconds']:.4f} s")
+
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
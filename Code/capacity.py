@@ -0,0 +1,140 @@
+import hashlib
+import os
+import sqlite3
+import numpy as np
+import coders
+
+
+def _open(method: str, source):
+    """
+    Возвращает кодер метода method для чтения контейнера
+    source: пути к файлу или байт.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return coders.reader(method)(source)
+
+    return coders.from_bytes(method, source)
+
+
+class CapacityIndex:
+    """
+    Индекс емкости контейнеров. Для каждого файла хранит число
+    пригодных для встраивания элементов, а для метода BMYY -
+    еще и упакованную маску подходящих блоков для каждого набора
+    порогов. Ключом служит хэш содержимого файла, поэтому записи
+    не устаревают при переименовании и копировании файлов.
+    Контейнер source задается путем к файлу или его байтами.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        """
+        Открывает индекс в базе SQLite по пути path.
+        """
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS capacity ("
+            "digest TEXT, method TEXT, params TEXT, "
+            "size INTEGER, width INTEGER, usable INTEGER, mask BLOB, "
+            "PRIMARY KEY (digest, method, params))"
+        )
+        # Хэши уже прочитанных файлов
+        self._digests = {}
+
+    def digest(self, source) -> str:
+        """
+        Возвращает хэш содержимого файла source или самого source,
+        если это байты или объект с протоколом буфера. Файл
+        читается заново, только если изменились его размер или
+        время изменения.
+        """
+        if not isinstance(source, (str, os.PathLike)):
+            return hashlib.sha256(source).hexdigest()
+
+        file_name = source
+        stat = os.stat(file_name)
+        key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+
+        if key not in self._digests:
+            h = hashlib.sha256()
+
+            with open(file_name, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+
+            self._digests[key] = h.hexdigest()
+
+        return self._digests[key]
+
+    def _get(self, digest: str, method: str, params: str) -> tuple:
+        """
+        Возвращает запись индекса (size, width, usable, mask) или None.
+        """
+        return self._db.execute(
+            "SELECT size, width, usable, mask FROM capacity "
+            "WHERE digest = ? AND method = ? AND params = ?",
+            (digest, method, params)
+        ).fetchone()
+
+    def _put(self, digest: str, method: str, params: str, size: int,
+             width: int = None, usable: int = None,
+             mask: bytes = None) -> None:
+        """
+        Сохраняет запись индекса.
+        """
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO capacity VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest, method, params, size, width,
+                 size if usable is None else usable, mask)
+            )
+
+    def mask(self, source, Pl: int, Ph: int, scan=None) -> np.array:
+        """
+        Возвращает маску подходящих блоков BMYY формы
+        (h // 8, w // 8) для порогов Pl и Ph. При отсутствии
+        записи маска вычисляется функцией scan, а если она
+        не задана - кодером, открытым на контейнере source.
+        """
+        params = f"{Pl}:{Ph}"
+        digest = self.digest(source)
+        row = self._get(digest, "bmyy", params)
+
+        if row is None:
+            if scan is None:
+                scan = _open("bmyy", source)._scan_mask
+
+            mask = scan(Pl, Ph)
+            self._put(digest, "bmyy", params, mask.size, mask.shape[1],
+                      np.count_nonzero(mask), np.packbits(mask).tobytes())
+            return mask
+
+        size, width, _, packed = row
+        mask = np.unpackbits(np.frombuffer(packed, np.uint8), count=size)
+        return mask.astype(bool).reshape(-1, width)
+
+    def elements(self, source, method: str) -> int:
+        """
+        Возвращает число элементов контейнера source, пригодных
+        для встраивания методом семейства LSB.
+        """
+        digest = self.digest(source)
+        row = self._get(digest, method, "")
+
+        if row is None:
+            size = _open(method, source)._size()
+            self._put(digest, method, "", size)
+            return size
+
+        return row[2]
+
+    def capacity(self, source, method: str,
+                 Pl: int = 210, Ph: int = 40, bits: int = 1) -> int:
+        """
+        Возвращает емкость контейнера source в байтах для метода
+        method, при необходимости с порогами Pl и Ph метода BMYY
+        или с числом bits младших бит элемента для методов LSB.
+        """
+        if method == "bmyy":
+            return np.count_nonzero(self.mask(source, Pl, Ph)) // 8
+
+        return self.elements(source, method) * bits // 8
@@ -1,29 +1,254 @@
+import hashlib
+import math
+import os
 import jpegio as jio
-import scipy.stats
 import numpy as np
+import instrument
+from concurrent.futures import ProcessPoolExecutor
 
 
-def chi_attack(file_name: str) -> None:
+def histogram(file_name: str, channel: int = 1) -> tuple:
     """
-    Реализует атаку хи-квадрат на JPEG файл. 
+    Возвращает гистограмму ДКП коэффициентов канала channel
+    в виде пары (low, counts), где counts[i] - число
+    коэффициентов, равных low + i.
     """
     # Считываем ДКП коэффициенты
-    dct = jio.read(file_name)
-    # Выбираем синий канал, в который спрятано сообщение.
-    # Здесь важно, что сообщение представляет собой шум.
-    container = dct.coef_arrays[1].ravel()[:]
-    # Строим гистограмму
-    unique, counts = np.unique(container, return_counts=True)
-    hist = dict(zip(unique, counts))
-    # Ищем соседние пары
-    unique.sort()
-    pairs = [(x, y) for (x, y) in zip(unique[:-1], unique[1:]) if x ^ y == 1]
+    with instrument.span("jio.read"):
+        dct = jio.read(file_name)
+
+    if instrument.enabled():
+        instrument.count("bytes_read", os.path.getsize(file_name))
+    container = dct.coef_arrays[channel].ravel()
+
+    # Сдвигаем коэффициенты к нулю и считаем их частоты
+    # за один проход, без сортировки
+    with instrument.span("chi.bincount"):
+        low = int(container.min())
+        return low, np.bincount(container - low)
+
+
+def chi_square(low: int, counts: np.array, exclude: tuple = ()) -> float:
+    """
+    Возвращает p-значение критерия хи-квадрат для гистограммы
+    (low, counts) по парам значений (2k, 2k + 1), встречающихся
+    в контейнере. Значения из exclude в пары не входят.
+    """
+    return float(_chi_square(low, np.atleast_2d(counts), exclude)[0])
+
+
+def _chi_square(low: int, counts: np.array, exclude: tuple) -> np.array:
+    """
+    Возвращает p-значения критерия хи-квадрат для каждой
+    строки матрицы гистограмм counts с общим началом low.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+
+    # Выравниваем гистограммы так, чтобы они начинались с четного
+    # значения и состояли из целого числа пар
+    if low % 2:
+        counts = np.pad(counts, ((0, 0), (1, 0)))
+        low -= 1
+
+    if counts.shape[1] % 2:
+        counts = np.pad(counts, ((0, 0), (0, 1)))
+
+    pairs = counts.reshape(len(counts), -1, 2)
+    even = low + 2 * np.arange(pairs.shape[1])
+    # Ищем соседние пары, оба значения которых встречаются
+    keep = (pairs > 0).all(axis=2)
+
+    if exclude:
+        keep &= ~np.isin(even, exclude) & ~np.isin(even + 1, exclude)
+
     # Строим наблюдаемое и ожидаемое распределения
-    observed = [hist[x] for (x, _) in pairs]
-    expected = [(hist[x] + hist[y]) / 2 for (x, y) in pairs]
+    observed = pairs[..., 0]
+    expected = np.where(keep, pairs.sum(axis=2) / 2, 1)
     # Считаем степень сходства
-    _, p = scipy.stats.chisquare(observed, f_exp=expected)
-    print(f"{p:.2}")
+    with instrument.span("chi.statistic"):
+        chi = np.where(keep, (observed - expected) ** 2 / expected, 0)
+        return _chi2_sf(chi.sum(axis=1), keep.sum(axis=1) - 1)
+
+
+def _chi2_sf(chi: np.array, dof: np.array) -> np.array:
+    """
+    Возвращает функцию выживания распределения хи-квадрат
+    со степенями свободы dof в точках chi. Не требует scipy,
+    импорт которого дольше самой атаки.
+    """
+    return np.array([_gammaq(k / 2, x / 2) if k > 0 else math.nan
+                     for x, k in zip(chi, dof)], dtype=np.float64)
+
+
+def _gammaq(a: float, x: float) -> float:
+    """
+    Возвращает регуляризованную верхнюю неполную гамма-функцию Q(a, x).
+    """
+    if x <= 0:
+        return 1.0
+
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+
+    # При малых x сходится ряд для P(a, x) = 1 - Q(a, x)
+    if x < a + 1:
+        term = total = 1 / a
+        n = a
+
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+
+        return max(0.0, 1 - total * math.exp(log_prefix))
+
+    # Иначе - цепная дробь для Q(a, x) по методу Лентца
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+
+        if abs(delta - 1) < 1e-15:
+            break
+
+    return math.exp(log_prefix) * h
+
+
+def chi_attack(file_name: str, channel: int = 1,
+               exclude: tuple = ()) -> float:
+    """
+    Реализует атаку хи-квадрат на JPEG файл.
+    Возвращает p-значение: близкое к единице
+    говорит о наличии шумоподобного сообщения.
+    """
+    # Выбираем синий канал, в который спрятано сообщение.
+    # Здесь важно, что сообщение представляет собой шум.
+    return chi_square(*histogram(file_name, channel), exclude)
+
+
+def chi_curve(file_name: str, checkpoints: int = 100, channel: int = 1,
+              exclude: tuple = ()) -> np.array:
+    """
+    Реализует последовательную атаку хи-квадрат: возвращает
+    массив p-значений для checkpoints растущих префиксов
+    контейнера. Длина префикса, на которой p-значение падает,
+    оценивает объем встроенного сообщения.
+    """
+    # Считываем ДКП коэффициенты
+    with instrument.span("jio.read"):
+        dct = jio.read(file_name)
+
+    if instrument.enabled():
+        instrument.count("bytes_read", os.path.getsize(file_name))
+    container = dct.coef_arrays[channel].ravel()
+    low = int(container.min())
+    size = int(container.max()) - low + 1
+    # Делим контейнер на порции, заканчивающиеся в контрольных точках
+    bounds = np.linspace(0, len(container), checkpoints + 1).astype(int)
+
+    # Считаем гистограмму каждой порции за один проход по контейнеру
+    with instrument.span("chi.bincount"):
+        hists = np.stack([
+            np.bincount(container[start:stop] - low, minlength=size)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ])
+
+    # Гистограммы префиксов - накопленные суммы гистограмм порций
+    return _chi_square(low, np.cumsum(hists, axis=0), exclude)
+
+
+class HistogramCache:
+    """
+    Кэш гистограмм ДКП коэффициентов, ключом которого служат
+    путь к файлу, время его изменения и номер канала.
+    """
+
+    def __init__(self, directory: str = None) -> None:
+        """
+        Возвращает кэш в памяти, а если задан каталог
+        directory - еще и на диске, между запусками.
+        """
+        self.directory = directory
+        self._memory = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _key(self, file_name: str, channel: int) -> str:
+        """
+        Возвращает ключ гистограммы файла.
+        """
+        path = os.path.abspath(file_name)
+        mtime = os.stat(path).st_mtime_ns
+        return hashlib.sha1(f"{path}:{mtime}:{channel}".encode()).hexdigest()
+
+    def get(self, file_name: str, channel: int = 1) -> tuple:
+        """
+        Возвращает гистограмму из кэша или None.
+        """
+        key = self._key(file_name, channel)
+
+        if key in self._memory:
+            return self._memory[key]
+
+        if self.directory is not None:
+            path = os.path.join(self.directory, key + ".npz")
+
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    self._memory[key] = (int(data["low"]), data["counts"])
+
+                return self._memory[key]
+
+        return None
+
+    def put(self, file_name: str, channel: int, hist: tuple) -> None:
+        """
+        Сохраняет гистограмму файла в кэш.
+        """
+        key = self._key(file_name, channel)
+        self._memory[key] = hist
+
+        if self.directory is not None:
+            low, counts = hist
+            path = os.path.join(self.directory, key + ".npz")
+            np.savez(path, low=low, counts=counts)
+
+
+def scan(files: list, channel: int = 1, exclude: tuple = (),
+         cache: HistogramCache = None, workers: int = None) -> dict:
+    """
+    Проводит атаку хи-квадрат на набор JPEG файлов и возвращает
+    словарь p-значений. Отсутствующие в кэше гистограммы
+    считаются параллельно пулом процессов, поэтому повторные
+    запуски с другими параметрами не декодируют файлы.
+    """
+    cache = HistogramCache() if cache is None else cache
+    hists = {file_name: cache.get(file_name, channel) for file_name in files}
+    missing = [file_name for file_name, hist in hists.items() if hist is None]
+
+    if missing:
+        with ProcessPoolExecutor(workers) as pool:
+            computed = pool.map(histogram, missing,
+                                [channel] * len(missing), chunksize=4)
+
+            for file_name, hist in zip(missing, computed):
+                cache.put(file_name, channel, hist)
+                hists[file_name] = hist
+
+    return {file_name: chi_square(*hist, exclude)
+            for file_name, hist in hists.items()}
 
 
 def main() -> None:
@@ -31,9 +256,11 @@ def main() -> None:
     Проверяет работоспособность программы.
     """
     # Пустой стегоконтейнер
-    chi_attack("Images/Lenna.jpg")
+    print(f"{chi_attack('Images/Lenna.jpg'):.2}")
     # Заполненный шумом стегоконтейнер
-    chi_attack("Images/JSteg_Lenna.jpg")
+    print(f"{chi_attack('Images/JSteg_Lenna.jpg'):.2}")
+    # p-значения по мере заполнения контейнера
+    print(np.round(chi_curve("Images/JSteg_Lenna.jpg", 10), 2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import functools
+import importlib
+import inspect
+
+# Методы встраивания: модуль, класс кодера, его параметры
+# и расширения файлов-контейнеров. Модули импортируются
+# только при обращении к методу, вместе с jpegio или PIL.
+CODERS = {
+    "png": ("png", "PNG", {}, (".png",)),
+    "png-blue": ("png", "PNG", {"channels": (2,)}, (".png",)),
+    "jsteg": ("jsteg", "JSteg", {}, (".jpg", ".jpeg")),
+    "jsteg-skip": ("jsteg", "JSteg", {"skip": True}, (".jpg", ".jpeg")),
+    "raw": ("raw", "Raw", {}, (".ppm", ".pgm")),
+    "bmyy": ("relation_dct", "BMYY", {}, (".jpg", ".jpeg")),
+}
+
+
+def load(method: str):
+    """
+    Импортирует модуль метода method и возвращает
+    конструктор его кодера с параметрами метода.
+    """
+    module, name, kwargs, _ = CODERS[method]
+    coder = getattr(importlib.import_module(module), name)
+    return functools.partial(coder, **kwargs)
+
+
+def reader(method: str):
+    """
+    Возвращает конструктор кодера метода method для чтения
+    контейнера: кодеры, отображающие файл в память (Raw),
+    открывают его без права записи.
+    """
+    coder = load(method)
+
+    if "writable" in inspect.signature(coder).parameters:
+        return functools.partial(coder, writable=False)
+
+    return coder
+
+
+def check_options(method: str, options: dict) -> None:
+    """
+    Проверяет, что кодер метода method принимает параметры
+    options. Параметры, заданные самим методом, например
+    channels у png-blue, изменить нельзя.
+    """
+    module, name, kwargs, _ = CODERS[method]
+    coder = getattr(importlib.import_module(module), name)
+    accepted = inspect.signature(coder).parameters
+    unknown = [k for k in options if k not in accepted or k in kwargs]
+
+    if unknown:
+        raise ValueError(f"Метод {method} не принимает параметры "
+                         f"{', '.join(unknown)}")
+
+
+def from_bytes(method: str, data, message: bytes = None, **options):
+    """
+    Возвращает кодер метода method для контейнера,
+    переданного байтами, с дополнительными параметрами options.
+    """
+    module, name, kwargs, _ = CODERS[method]
+    coder = getattr(importlib.import_module(module), name)
+    check_options(method, options)
+
+    if not hasattr(coder, "from_bytes"):
+        raise ValueError(f"Метод {method} работает только с файлами")
+
+    return coder.from_bytes(data, message, **kwargs, **options)
+
+
+def extensions(method: str) -> tuple:
+    """
+    Возвращает расширения файлов-контейнеров метода method.
+    """
+    return CODERS[method][3]
+
+
+def positional(method: str) -> bool:
+    """
+    Возвращает истину, если сообщение метода method извлекается
+    только по ключу позиций блоков, полученному при встраивании.
+    """
+    return CODERS[method][1] == "BMYY"
+
+
+def encode_framed(method: str, stego, positions: bytes = None,
+                  key: str = "auto") -> bytes:
+    """
+    Встраивает сообщение кодера stego метода method с заголовком.
+    Для BMYY возвращает ключ позиций в формате key, по умолчанию -
+    самый короткий из форматов, для остальных методов - None.
+    Если переданы позиции positions прошлого встраивания BMYY,
+    сообщение обновляется в тех же блоках.
+    """
+    if positional(method):
+        return stego.encode_framed(positions, key)
+
+    return stego.encode_framed()
+
+
+def decode_framed(method: str, stego, positions: bytes = None) -> bytes:
+    """
+    Извлекает сообщение с заголовком кодером stego метода
+    method, для BMYY - по ключу позиций positions.
+    """
+    if positional(method):
+        if positions is None:
+            raise ValueError("Для BMYY требуются позиции блоков")
+
+        return stego.decode_framed(positions)
+
+    return stego.decode_framed()
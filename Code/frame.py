@@ -0,0 +1,65 @@
+import struct
+import zlib
+
+# Формат заголовка: сигнатура, длина сообщения в байтах
+# и его контрольная сумма CRC-32
+MAGIC = b"SG"
+_HEADER = struct.Struct(">2sII")
+# Размер заголовка в байтах
+HEADER_SIZE = _HEADER.size
+
+
+def message_size(spec: str, capacity: int) -> int:
+    """
+    Переводит размер сообщения spec - число байт или процент
+    вида "10%" - в байты для контейнера емкости capacity байт.
+    Сообщение вместе с заголовком помещается в контейнер.
+    """
+    # Часть емкости занимает заголовок сообщения
+    capacity = max(0, capacity - HEADER_SIZE)
+
+    if spec.endswith("%"):
+        return min(capacity, max(1, capacity * int(spec[:-1]) // 100))
+
+    return min(int(spec), capacity)
+
+
+def header(length: int, crc: int) -> bytes:
+    """
+    Возвращает заголовок сообщения длины length
+    с контрольной суммой crc.
+    """
+    return _HEADER.pack(MAGIC, length, crc)
+
+
+def pack(message: bytes) -> bytes:
+    """
+    Возвращает сообщение вместе с заголовком.
+    """
+    return header(len(message), zlib.crc32(message)) + bytes(message)
+
+
+def parse(data: bytes) -> tuple:
+    """
+    Разбирает заголовок и возвращает длину
+    сообщения и его контрольную сумму.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Контейнер слишком мал для заголовка")
+
+    magic, length, crc = _HEADER.unpack(bytes(data[:HEADER_SIZE]))
+
+    if magic != MAGIC:
+        raise ValueError("Контейнер не содержит сообщения с заголовком")
+
+    return length, crc
+
+
+def check(message: bytes, crc: int) -> bytes:
+    """
+    Проверяет контрольную сумму сообщения и возвращает его.
+    """
+    if zlib.crc32(message) != crc:
+        raise ValueError("Контрольная сумма сообщения не совпадает")
+
+    return message
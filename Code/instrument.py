@@ -0,0 +1,272 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+# Инструментирование выключено по умолчанию. Переменная окружения
+# STEGO_INSTRUMENT=1 включает его при импорте, а STEGO_INSTRUMENT=profile
+# включает еще и cProfile, например в процессах пакетной обработки.
+_enabled = False
+_profiler = None
+_lock = threading.Lock()
+# Имя интервала -> [число вызовов, суммарное время, максимальное время]
+_spans = {}
+# Имя счетчика -> значение
+_counters = {}
+# Профили, полученные от других процессов, объединенные в pstats.Stats
+_merged = None
+
+
+class _NullSpan:
+    """
+    Интервал, который ничего не измеряет. Один общий
+    экземпляр возвращается, пока инструментирование выключено.
+    """
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Profile:
+    """
+    Данные pstats профиля другого процесса в виде,
+    который принимают pstats.Stats и Stats.add.
+    """
+
+    def __init__(self, data: dict) -> None:
+        self.stats = data
+
+    def create_stats(self) -> None:
+        pass
+
+
+class _Span:
+    """
+    Интервал, время которого добавляется к статистике.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self._start
+
+        with _lock:
+            stat = _spans.setdefault(self._name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+
+
+def enable(profile: bool = False) -> None:
+    """
+    Включает сбор статистики, а если profile истинен -
+    еще и профилирование cProfile.
+    """
+    global _enabled, _profiler
+    _enabled = True
+
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def enabled() -> bool:
+    """
+    Возвращает истину, если сбор статистики включен. Значения
+    счетчиков, требующие системных вызовов, например размер
+    файла, вычисляются только при включенной статистике.
+    """
+    return _enabled
+
+
+def disable() -> None:
+    """
+    Выключает сбор статистики и профилирование.
+    Собранная статистика сохраняется.
+    """
+    global _enabled
+    _enabled = False
+
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def reset() -> None:
+    """
+    Сбрасывает собранную статистику и профиль.
+    """
+    global _profiler, _merged
+
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _merged = None
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = cProfile.Profile()
+
+        if _enabled:
+            _profiler.enable()
+
+
+def span(name: str):
+    """
+    Возвращает контекстный менеджер, измеряющий время
+    выполнения блока под именем name.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+
+    return _Span(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Увеличивает счетчик name на value.
+    """
+    if not _enabled:
+        return
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def stats() -> dict:
+    """
+    Возвращает собранную статистику: для интервалов - число
+    вызовов, суммарное и максимальное время в секундах,
+    для счетчиков - их значения.
+    """
+    with _lock:
+        spans = {name: {"count": n, "total": total, "max": longest}
+                 for name, (n, total, longest) in _spans.items()}
+        return {"spans": spans, "counters": dict(_counters)}
+
+
+def drain() -> dict:
+    """
+    Возвращает собранную статистику, как stats, и сбрасывает
+    ее. Процессы-исполнители так передают статистику каждой
+    задачи в основной процесс. Если включено профилирование,
+    под ключом profile возвращаются данные pstats, и профиль
+    начинается заново.
+    """
+    global _profiler
+
+    with _lock:
+        spans = {name: {"count": n, "total": total, "max": longest}
+                 for name, (n, total, longest) in _spans.items()}
+        data = {"spans": spans, "counters": dict(_counters)}
+        _spans.clear()
+        _counters.clear()
+
+    if _profiler is not None:
+        # create_stats останавливает профилировщик
+        _profiler.create_stats()
+        data["profile"] = _profiler.stats
+        _profiler = cProfile.Profile()
+
+        if _enabled:
+            _profiler.enable()
+
+    return data
+
+
+def merge(data: dict) -> None:
+    """
+    Добавляет к статистике процесса статистику data,
+    полученную от stats или drain другого процесса.
+    """
+    global _merged
+
+    with _lock:
+        if "profile" in data:
+            profile = _Profile(data["profile"])
+
+            if _merged is None:
+                _merged = pstats.Stats(profile)
+
+            else:
+                _merged.add(profile)
+
+        for name, stat in data["spans"].items():
+            own = _spans.setdefault(name, [0, 0.0, 0.0])
+            own[0] += stat["count"]
+            own[1] += stat["total"]
+            own[2] = max(own[2], stat["max"])
+
+        for name, value in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def export(format: str = "json") -> str:
+    """
+    Возвращает статистику в формате json или в текстовом
+    формате Prometheus.
+    """
+    data = stats()
+
+    if format == "json":
+        return json.dumps(data, indent=2) + "\n"
+
+    if format != "prometheus":
+        raise ValueError(f"Неизвестный формат {format}")
+
+    lines = [
+        "# TYPE stego_span_seconds_total counter",
+        "# TYPE stego_span_calls_total counter",
+        "# TYPE stego_span_seconds_max gauge",
+        "# TYPE stego_events_total counter",
+    ]
+
+    for name, stat in sorted(data["spans"].items()):
+        label = f'{{span="{name}"}}'
+        lines.append(f"stego_span_seconds_total{label} {stat['total']:.9f}")
+        lines.append(f"stego_span_calls_total{label} {stat['count']}")
+        lines.append(f"stego_span_seconds_max{label} {stat['max']:.9f}")
+
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f'stego_events_total{{counter="{name}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+def profile(sort: str = "cumulative", limit: int = 30) -> str:
+    """
+    Возвращает текстовый отчет cProfile, включая профили,
+    полученные от других процессов через merge, или пустую
+    строку, если профилирование не включалось.
+    """
+    if _profiler is None and _merged is None:
+        return ""
+
+    stream = io.StringIO()
+    report = pstats.Stats(stream=stream)
+
+    with _lock:
+        report.add(*(p for p in (_profiler, _merged) if p is not None))
+
+    # Снимок останавливает профилировщик, продолжаем профилировать
+    if _profiler is not None and _enabled:
+        _profiler.enable()
+
+    report.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+if os.environ.get("STEGO_INSTRUMENT"):
+    enable(profile=os.environ["STEGO_INSTRUMENT"] == "profile")
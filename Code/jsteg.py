@@ -1,6 +1,8 @@
+import os
 import jpegio as jio
 import numpy as np
-import cv2
+import instrument
+import memfile
 from lsb import LSB
 
 
@@ -9,46 +11,201 @@ class JSteg(LSB):
     Реализация стеганографического алгоритма JSteg.
     """
 
-    def __init__(self, file_name: str, message: str = None) -> None:
+    def __init__(self, file_name: str, message: str = None,
+                 skip: bool = False, seed: int = None) -> None:
         """
         Возвращает простой JSteg кодер,
         принимает на вход имя файла и сообщение.
+
+        Если skip истинен, используются все три канала, но, как
+        в оригинальном JSteg, пропускаются DC коэффициенты и
+        коэффициенты, по модулю не большие 1, а встраивание
+        меняет младший бит модуля. Иначе сообщение встраивается
+        во все коэффициенты канала Cb. Если задан seed, сообщение
+        рассеивается по пригодным коэффициентам.
         """
         self.file_name = file_name
         # Считываем все коэффициенты ДКП
-        self.dct = jio.read(self.file_name)
-        # Оставляем только Cb канал.
-        # Коэффициенты упорядочены в зигзагообразном порядке
-        container = self.dct.coef_arrays[1]
-        super().__init__(container, message)
+        with instrument.span("jio.read"):
+            self.dct = jio.read(self.file_name)
+
+        if instrument.enabled():
+            instrument.count("bytes_read", os.path.getsize(file_name))
+        self._usable = None
+
+        if skip:
+            container = self.dct.coef_arrays
+            # Встраивание меняет модуль 2k на 2k + 1 и обратно, поэтому
+            # пригодные коэффициенты остаются пригодными, и их
+            # индексы можно найти один раз. Длина кода Хаффмана
+            # коэффициента при этом тоже не меняется
+            self._usable = [self._usable_index(c) for c in container]
+            # Номера первых элементов каждого канала
+            self._bounds = np.cumsum([0] + [len(i) for i in self._usable])
+
+        else:
+            # Оставляем только Cb канал.
+            # Коэффициенты упорядочены в зигзагообразном порядке
+            container = self.dct.coef_arrays[1]
+
+        super().__init__(container, message, seed=seed)
+
+    @staticmethod
+    def _usable_index(coef: np.array) -> np.array:
+        """
+        Возвращает плоские индексы AC коэффициентов канала,
+        по модулю больших 1.
+        """
+        usable = np.absolute(coef) > 1
+        # DC коэффициенты стоят в левом верхнем углу каждого блока
+        usable[::8, ::8] = False
+        return np.flatnonzero(usable)
+
+    def _size(self) -> int:
+        """
+        Возвращает число элементов контейнера.
+        """
+        if self._usable is None:
+            return self._container.size
+
+        return int(self._bounds[-1])
+
+    def _coefficients(self, index):
+        """
+        Для элементов с номерами index перебирает каналы: плоское
+        представление коэффициентов канала, номера элементов
+        этого канала в index и индексы их коэффициентов.
+        Срез разбивается на срезы индексов каналов, поэтому
+        перебираются только запрошенные элементы.
+        """
+        bounds = self._bounds
+
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self._size())
+
+            for c, usable in enumerate(self._usable):
+                first = min(max(start, bounds[c]), bounds[c + 1])
+                last = min(max(stop, bounds[c]), bounds[c + 1])
+
+                if first < last:
+                    yield (self._container[c].ravel(),
+                           slice(first - start, last - start),
+                           usable[first - bounds[c]:last - bounds[c]])
+
+            return
+
+        channel = np.searchsorted(bounds, index, side="right") - 1
+
+        for c, usable in enumerate(self._usable):
+            selected = np.flatnonzero(channel == c)
+            yield (self._container[c].ravel(), selected,
+                   usable[index[selected] - bounds[c]])
+
+    def _gather(self, index: np.array) -> np.array:
+        """
+        Возвращает элементы с номерами index.
+        """
+        if self._usable is None:
+            return self._container.ravel()[index]
+
+        if isinstance(index, slice):
+            n = len(range(*index.indices(self._size())))
+
+        else:
+            n = len(index)
+
+        values = np.empty(n, dtype=self._container[0].dtype)
+
+        for flat, selected, coef in self._coefficients(index):
+            values[selected] = np.absolute(flat[coef])
+
+        return values
+
+    def _scatter(self, index: np.array, values: np.array) -> None:
+        """
+        Записывает values в элементы с номерами index.
+        """
+        if self._usable is None:
+            self._container.ravel()[index] = values
+            return
+
+        for flat, selected, coef in self._coefficients(index):
+            part = values[selected]
+            flat[coef] = np.where(flat[coef] < 0, -part, part)
 
     def _to_elements(self) -> np.array:
         """
         Возвращает репрезентацию контейнера
         как последовательности элементов.
         """
-        return self._container.ravel()[:]
+        if self._usable is None:
+            return self._container.ravel()[:]
+
+        # Собираем модули пригодных коэффициентов всех каналов
+        return np.concatenate([np.absolute(c.ravel()[index]) for c, index
+                               in zip(self._container, self._usable)])
 
     def _from_elements(self, elements: np.array) -> None:
         """
         Строит контейнер по последовательности
         элементов.
         """
-        self.dct.coef_arrays[1].ravel()[:] = elements
+        if self._usable is None:
+            self.dct.coef_arrays[1].ravel()[:] = elements
+            return
+
+        # Раскладываем модули обратно по каналам, сохраняя знаки
+        offset = 0
+
+        for c, index in zip(self._container, self._usable):
+            flat = c.ravel()
+            part = elements[offset:offset + len(index)]
+            flat[index] = np.where(flat[index] < 0, -part, part)
+            offset += len(index)
+
+    @classmethod
+    def from_bytes(cls, data, message: bytes = None, **kwargs):
+        """
+        Возвращает кодер для изображения, переданного байтами
+        или объектом с протоколом буфера. jpegio читает файл
+        в памяти, коэффициенты остаются в кодере.
+        """
+        with memfile.path(data) as file_name:
+            stego = cls(file_name, message, **kwargs)
+
+        # Файл в памяти уже закрыт, сохранять можно только
+        # через save_as
+        stego.file_name = None
+        return stego
 
     def save(self) -> None:
         """
         Перезаписывает исходный файл
         новый контейнером.
         """
-        jio.write(self.dct, self.file_name)
+        if self.file_name is None:
+            raise ValueError("Исходного файла нет, используйте save_as")
+
+        self.save_as(self.file_name)
 
     def save_as(self, file_name: str) -> None:
         """
         Сохраняет контейнер в файл,
         заданный параментром file_name.
         """
-        jio.write(self.dct, file_name)
+        with instrument.span("jio.write"):
+            jio.write(self.dct, file_name)
+
+        if instrument.enabled():
+            instrument.count("bytes_written", os.path.getsize(file_name))
+
+    def to_bytes(self) -> bytes:
+        """
+        Возвращает контейнер в виде байт файла JPEG.
+        """
+        with memfile.path() as file_name:
+            self.save_as(file_name)
+            return memfile.read(file_name)
 
 
 def main() -> None:
@@ -57,20 +214,19 @@ def main() -> None:
     """
     # Считываем сообщение.
     with open("Messages/Alice in wonderland.txt", "rb") as f:
-        message = f.read()[:80000]
+        message = f.read()[:79000]
 
-    # Запоминаем длину сообщения.
-    size = len(message)
     # Кодируем сообщение.
     jsteg = JSteg("Images/Lenna.jpg", message)
-    jsteg.encode()
+    # Вместе с сообщением встраиваем его длину и контрольную сумму.
+    jsteg.encode_framed()
     jsteg.save_as("Images/JSteg_Lenna.jpg")
     # Переоткрываем изображение.
     jsteg = JSteg("Images/JSteg_Lenna.jpg")
-    # Декодируем сообщение.
-    decoded = jsteg.decode()
+    # Декодируем сообщение, обрабатывая только занятые им элементы.
+    decoded = jsteg.decode_framed()
     # Проверяем, что сообщения до и после совпадают.
-    new_message = decoded[:size].decode()
+    new_message = decoded.decode()
     print(f"{new_message == message.decode()}")
 
 
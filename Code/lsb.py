@@ -1,13 +1,92 @@
+import zlib
 import numpy as np
+import frame
+import instrument
+import permutation
 from abc import ABC, abstractmethod
+from typing import Iterable, Iterator
+
+# Наибольшее число младших бит элемента, занимаемых сообщением
+MAX_BITS = 4
+
+
+def _to_groups(data: np.array, bits: int) -> np.array:
+    """
+    Разбивает байты data на группы по bits бит, начиная
+    со старших. Число bits должно делить 8.
+    """
+    if bits == 1:
+        return np.unpackbits(data)
+
+    # Каждый байт дает 8 // bits групп: сдвигаем его сразу на все
+    # смещения, не раскладывая на отдельные биты
+    shifts = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+    return ((data[:, None] >> shifts) & ((1 << bits) - 1)).ravel()
+
+
+def _from_groups(groups: np.array, bits: int) -> np.array:
+    """
+    Собирает байты из групп по bits бит, обратная
+    к _to_groups операция.
+    """
+    groups = groups.astype(np.uint8)
+
+    if bits == 1:
+        return np.packbits(groups)
+
+    # Складываем столбцы групп со сдвигами: их не больше четырех
+    columns = groups.reshape(-1, 8 // bits)
+    data = columns[:, 0] << (8 - bits)
+
+    for i in range(1, 8 // bits):
+        data |= columns[:, i] << (8 - bits * (i + 1))
+
+    return data
+
+
+def _to_stream(groups: np.array, bits: int) -> np.array:
+    """
+    Раскладывает группы по bits бит в последовательность бит.
+    """
+    shifts = np.arange(bits - 1, -1, -1)
+    return ((groups[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+
+
+def _from_stream(stream: np.array, bits: int) -> np.array:
+    """
+    Собирает группы по bits бит из последовательности бит,
+    длина которой кратна bits.
+    """
+    weights = 1 << np.arange(bits - 1, -1, -1)
+    return stream.reshape(-1, bits) @ weights
 
 
 class LSB(ABC):
-    def __init__(self, container, message: bytes = None) -> None:
+    # Число элементов контейнера, обрабатываемых за один шаг.
+    # Пиковая память кодирования и декодирования
+    # ограничена этим размером, а не размером сообщения.
+    chunk_size = 1 << 20
+
+    def __init__(self, container, message: bytes = None,
+                 bits: int = 1, seed: int = None) -> None:
         """
         Возвращает простой lsb-кодер,
-        принимает на вход контейнер и сообщение (массив байт).
+        принимает на вход контейнер и сообщение: массив байт,
+        файлоподобный объект или итератор по массивам байт.
+
+        Сообщение занимает bits младших бит каждого элемента,
+        от 1 до MAX_BITS. Если задан порождающий элемент seed,
+        сообщение рассеивается по элементам, выбранным ключевой
+        перестановкой, иначе записывается с начала контейнера.
         """
+        if not 1 <= bits <= MAX_BITS:
+            raise ValueError(f"Число бит должно быть от 1 до {MAX_BITS}")
+
+        self._bits = bits
+        self._seed = seed
+        # Число элементов, измененных последним обновлением
+        self.changed = 0
+
         if message is None:
             # По умолчанию сообщение пустое
             self.message = []
@@ -17,35 +96,259 @@ class LSB(ABC):
 
         self._container = container
 
-    def encode(self) -> None:
+    def capacity(self) -> int:
         """
-        Кодирует сообщение в контейнер.
+        Возвращает емкость контейнера в байтах.
         """
-        # Получаем последовательность элементов контейнера
-        elements = self._to_elements()
-        # Преобразуем сообщение к бинарному виду
-        np_message = np.unpackbits(np.frombuffer(
-            self.message, dtype=np.uint8)).ravel()
-        n = len(np_message)
-        # Меняем наименее значимый бит так,
-        # чтобы он кодировал биты сообщения
-        elements[:n] = (elements[:n] & ~1) | np_message
-        # Из элементов собираем контейнер обратно
-        self._from_elements(elements)
+        return self._size() * self._bits // 8
 
-    def decode(self) -> bytes:
+    def encode(self, update: bool = False) -> None:
         """
-        Декодирует сообщение из контейнера.
+        Кодирует сообщение в контейнер. Если update истинен,
+        изменяются только элементы, биты которых отличаются
+        от уже записанных в контейнер.
         """
-        # Получаем последовательность элементов контейнера
-        elements = self._to_elements()
+        self.changed = 0
+        # Встраиваем сообщение с начала контейнера
+        self._embed(self._chunks(self.message, self.chunk_size // 8),
+                    update=update)
+
+    def encode_framed(self, update: bool = False) -> None:
+        """
+        Кодирует сообщение в контейнер вместе с заголовком,
+        содержащим длину сообщения и его контрольную сумму.
+        Если update истинен, изменяются только элементы, биты
+        которых отличаются от уже записанных в контейнер.
+        """
+        length, crc = 0, 0
+
+        def payload() -> Iterator[bytes]:
+            # Длину и контрольную сумму считаем по ходу
+            # встраивания, чтобы не читать сообщение дважды
+            nonlocal length, crc
+
+            for chunk in self._chunks(self.message, self.chunk_size // 8):
+                length += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+
+        self.changed = 0
+        # Сначала встраиваем сообщение после места под заголовок,
+        # затем сам заголовок
+        self._embed(payload(), 8 * frame.HEADER_SIZE, update)
+        self._embed([frame.header(length, crc)], update=update)
+
+    def _embed(self, chunks: Iterable[bytes], offset: int = 0,
+               update: bool = False) -> int:
+        """
+        Встраивает порции сообщения chunks, начиная с бита offset.
+        Элементы читаются и записываются только на занятых
+        позициях, весь контейнер при этом не перебирается, и
+        стоимость пропорциональна длине сообщения. Если update
+        истинен, в контейнер записываются только элементы, биты
+        которых изменились. Возвращает номер бита после
+        последнего записанного.
+        """
+        bits = self._bits
+        mask = (1 << bits) - 1
+        size = self._size()
+
+        for chunk in chunks:
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            n = 8 * len(data)
+
+            if offset + n > bits * size:
+                raise ValueError("Сообщение не помещается в контейнер")
+
+            # Порция занимает элементы с номерами с start по end - 1
+            start, head = divmod(offset, bits)
+            end = -(-(offset + n) // bits)
+            index = self._positions(start, end, size)
+            part = self._gather(index)
+            groups = self._groups(part, data, head)
+            # Меняем bits наименее значимых бит так,
+            # чтобы они кодировали биты сообщения
+            new = (part & ~mask) | groups
+
+            if update:
+                # Сравниваем новые элементы с текущими
+                # и записываем только отличающиеся
+                with instrument.span("lsb.update"):
+                    if isinstance(index, slice):
+                        index = np.arange(start, end)
+
+                    changed = np.flatnonzero(new != part)
+                    self._scatter(index[changed], new[changed])
+
+                instrument.count("elements_changed", len(changed))
+                self.changed += len(changed)
+
+            else:
+                with instrument.span("lsb.embed"):
+                    self._scatter(index, new)
+
+            instrument.count("bits_embedded", n)
+            offset += n
+
+        return offset
+
+    def _groups(self, part: np.array, data: np.array, head: int) -> np.array:
+        """
+        Возвращает группы по bits бит для записи байт data в
+        элементы part, начиная с бита head первого из них.
+        """
+        bits = self._bits
+
+        # Преобразуем порцию сообщения в группы по bits бит
+        with instrument.span("lsb.unpackbits"):
+            if head == 0 and 8 % bits == 0:
+                return _to_groups(data, bits)
+
+            # Порция начинается или заканчивается внутри
+            # элемента: дополняем ее битами, уже записанными
+            # в крайние элементы
+            edges = _to_stream(part[[0, -1]] & ((1 << bits) - 1), bits)
+            tail = len(part) * bits - head - 8 * len(data)
+            stream = np.concatenate([edges[:head], np.unpackbits(data),
+                                     edges[2 * bits - tail:]])
+            return _from_stream(stream, bits)
+
+    def decode(self, n_bytes: int = None, offset: int = 0) -> bytes:
+        """
+        Декодирует n_bytes байт сообщения из контейнера, начиная
+        с байта offset, по умолчанию - всю емкость контейнера.
+        """
+        return b"".join(self.iter_decode(n_bytes, offset))
+
+    def decode_framed(self) -> bytes:
+        """
+        Декодирует сообщение, закодированное вместе с заголовком.
+        Обрабатываются только элементы, занятые заголовком
+        и самим сообщением.
+        """
+        length, crc = frame.parse(self.decode(frame.HEADER_SIZE))
+        return frame.check(self.decode(length, frame.HEADER_SIZE), crc)
+
+    def iter_decode(self, n_bytes: int = None,
+                    offset: int = 0) -> Iterator[bytes]:
+        """
+        Лениво декодирует сообщение из контейнера,
+        возвращая его порциями не более chunk_size // 8 байт.
+        """
+        # Элементы читаются только на позициях запрошенных байт
+        n_elements = self._size()
+        bits = self._bits
+        mask = (1 << bits) - 1
         # Выбираем размер сообщения так, чтобы он был кратен размеру байта
-        size = len(elements) // 8 * 8
-        # Сообщение считываем из наименее значащих бит элементов контейнера
-        np_message = (elements[:size] & 1)
-        # Преобразуем битовую последовательность в байты
-        message = np.packbits(np_message.reshape(-1, 8), axis=-1).tobytes()
-        return message
+        size = n_elements * bits // 8 * 8
+
+        if n_bytes is not None:
+            size = min(size, 8 * (offset + n_bytes))
+
+        # Шаг кратен и байту, и числу бит в элементе
+        step = 8 * bits * max(self.chunk_size // 8, 1)
+
+        for first in range(8 * offset, size, step):
+            last = min(first + step, size)
+            start, head = divmod(first, bits)
+
+            with instrument.span("lsb.packbits"):
+                # Сообщение считываем из наименее значащих бит элементов
+                index = self._positions(start, -(-last // bits),
+                                        n_elements)
+                groups = self._gather(index) & mask
+
+                # Преобразуем группы бит в байты
+                if head == 0 and 8 % bits == 0:
+                    chunk = _from_groups(groups, bits)
+
+                else:
+                    stream = _to_stream(groups, bits)
+                    chunk = np.packbits(stream[head:head + last - first])
+
+            instrument.count("bits_extracted", last - first)
+            yield chunk.tobytes()
+
+    def _positions(self, start: int, end: int, size: int):
+        """
+        Возвращает индексы элементов с номерами с start по end - 1
+        среди size элементов: срез в последовательном режиме или
+        массив их образов при ключевой перестановке.
+        """
+        if self._seed is None:
+            return slice(start, end)
+
+        # Перестановка вычисляется только для занятых номеров,
+        # поэтому короткое сообщение не требует перестановки
+        # всего контейнера
+        with instrument.span("lsb.permutation"):
+            return permutation.Permutation(size, self._seed)(
+                np.arange(start, end))
+
+    @staticmethod
+    def _chunks(message, size: int) -> Iterator[bytes]:
+        """
+        Разбивает сообщение на порции по size байт (последняя
+        может быть короче). Сообщение может быть массивом байт,
+        файлоподобным объектом или итератором по массивам байт.
+        """
+        size = max(size, 1)
+
+        # Объект с протоколом буфера нарезаем без копирования
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            view = memoryview(message).cast("B")
+
+            for start in range(0, len(view), size):
+                yield view[start:start + size]
+
+            return
+
+        # Файлоподобный объект читаем порциями
+        if hasattr(message, "read"):
+            while True:
+                chunk = message.read(size)
+
+                if not chunk:
+                    return
+
+                yield chunk
+
+        # Порции итератора собираем в блоки фиксированного размера
+        buffer = bytearray()
+
+        for part in message:
+            buffer += part
+
+            while len(buffer) >= size:
+                yield bytes(buffer[:size])
+                del buffer[:size]
+
+        if buffer:
+            yield bytes(buffer)
+
+    def _size(self) -> int:
+        """
+        Возвращает число элементов контейнера.
+        """
+        return len(self._to_elements())
+
+    def _gather(self, index) -> np.array:
+        """
+        Возвращает элементы с номерами index: срезом или массивом
+        номеров. Наследники могут читать их из контейнера,
+        не собирая все элементы.
+        """
+        return self._to_elements()[index]
+
+    def _scatter(self, index, values: np.array) -> None:
+        """
+        Записывает values в элементы с номерами index: срезом или
+        массивом номеров. Наследники могут изменять контейнер
+        на месте, не собирая его заново.
+        """
+        elements = self._to_elements()
+        elements[index] = values
+        self._from_elements(elements)
 
     @abstractmethod
     def _to_elements(self) -> np.array:
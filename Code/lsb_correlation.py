@@ -1,25 +1,167 @@
+import os
 import numpy as np
-import cv2
+from concurrent.futures import ProcessPoolExecutor
 
+# Наибольшее число каналов изображения в статистике корпуса
+MAX_CHANNELS = 4
 
-def pretty_stat(X: np.array, name: str) -> None:
+
+def read_gray(file_name: str) -> np.array:
     """
-    Печатает функцию распределения данной дискретной выборки.
+    Считывает изображение в градациях серого.
+    """
+    # OpenCV импортируется только при чтении файла: он нужен
+    # лишь здесь, а его импорт дольше всего остального анализа
+    import cv2
+
+    return cv2.imread(file_name, 0)
+
+
+def lsb_comparison(image: np.array) -> np.array:
+    """
+    Возвращает массив сравнений соседних наименее значащих
+    бит изображения, развернутого в последовательность.
+    """
+    # Получим только последний бит.
+    bits = (image & 1)
+    # Преобразуем матрицу бит в массив бит.
+    bits = bits.ravel()[:]
+    # Сравним 2 соседних бита.
+    return (bits[1:] == bits[:-1])
+
+
+def frequencies(X: np.array) -> dict:
+    """
+    Возвращает функцию распределения данной дискретной выборки.
     """
     size = len(X)
+
+    # Для логической выборки достаточно одного подсчета, без сортировки
+    if X.dtype == bool:
+        true = np.count_nonzero(X)
+        counts = {False: size - true, True: true}
+        return {key: count / size for key, count in counts.items() if count}
+
     # Посчитаем частоты элементов последовательности
-    comparison = dict(zip(*np.unique(X, return_counts=True)))
-    # Выведем статистику на экран
-    stat = f"{name}: "
+    values, counts = np.unique(X, return_counts=True)
+    return {key: count / size for key, count in zip(values, counts)}
+
 
-    for key, value in comparison.items():
-        stat += f"P({key}) = {value / size:.2}, "
+def pretty_stat(X: np.array, name: str) -> None:
+    """
+    Печатает функцию распределения данной дискретной выборки.
+    """
+    comparison = frequencies(X)
 
     if len(comparison) == 0:
-        print(stat + "empty")
+        print(f"{name}: empty")
+        return
+
+    # Выведем статистику на экран
+    print(f"{name}: " + ", ".join(f"P({key}) = {value:.2}"
+                                  for key, value in comparison.items()))
+
 
-    else:
-        print(stat[:-2])
+def lsb_rates(image: np.array) -> tuple:
+    """
+    Возвращает доли совпадений наименее значащих бит соседних
+    по горизонтали и по вертикали пикселей: по всем каналам
+    вместе и по каждому каналу отдельно.
+    """
+    if image.ndim == 2:
+        image = image[..., None]
+
+    h, w, channels = image.shape
+    horizontal = np.empty(channels)
+    vertical = np.empty(channels)
+
+    # Каналы обрабатываются по очереди: подсчет по всему массиву
+    # плоскости намного быстрее подсчета вдоль осей
+    for c in range(channels):
+        bits = image[..., c] & 1
+        # Сдвинутые срезы сравнивают соседей без копирования
+        horizontal[c] = np.count_nonzero(bits[:, 1:] != bits[:, :-1])
+        vertical[c] = np.count_nonzero(bits[1:] != bits[:-1])
+
+    # Переходим от числа различий к доле совпадений
+    pairs_h, pairs_v = max(h * (w - 1), 1), max((h - 1) * w, 1)
+    channel_h = 1 - horizontal / pairs_h
+    channel_v = 1 - vertical / pairs_v
+    return (channel_h.mean(), channel_v.mean(), channel_h, channel_v)
+
+
+def _analyze(file_name: str, thumbnails: str = None,
+             scale: int = 8) -> tuple:
+    """
+    Считает статистику для одного изображения и, если задан каталог
+    thumbnails, сохраняет в него уменьшенную в scale раз плоскость
+    младших бит. Выполняется в процессе-исполнителе.
+    """
+    from PIL import Image
+
+    try:
+        image = np.array(Image.open(file_name))
+
+    except Exception:
+        # Нечитаемый файл не прерывает обработку корпуса
+        nan = np.full(MAX_CHANNELS, np.nan)
+        return (file_name, 0, 0, 0, np.nan, np.nan, nan, nan)
+
+    horizontal, vertical, channel_h, channel_v = lsb_rates(image)
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    # Отсутствующие каналы заполняются NaN
+    per_h = np.full(MAX_CHANNELS, np.nan)
+    per_v = np.full(MAX_CHANNELS, np.nan)
+    per_h[:channels] = channel_h[:MAX_CHANNELS]
+    per_v[:channels] = channel_v[:MAX_CHANNELS]
+
+    if thumbnails is not None:
+        import visual_lsb
+
+        # Расширение исходного файла сохраняется в имени, чтобы
+        # 1.png и 1.jpg не перезаписывали друг друга
+        name = os.path.basename(file_name) + ".png"
+        visual_lsb.save_thumbnail(visual_lsb.lsb_thumbnail(image, scale),
+                                  os.path.join(thumbnails, name))
+
+    return (file_name, image.shape[0], image.shape[1], channels,
+            horizontal, vertical, per_h, per_v)
+
+
+def analyze(files: list, workers: int = None, thumbnails: str = None,
+            scale: int = 8) -> np.array:
+    """
+    Считает статистику младших бит для корпуса изображений
+    пулом процессов. Возвращает структурированный массив с полями
+    file, height, width, channels, horizontal, vertical и массивами
+    channel_horizontal, channel_vertical по каналам. Если задан
+    каталог thumbnails, в него сохраняются уменьшенные плоскости.
+    """
+    files = list(files)
+
+    if thumbnails is not None:
+        os.makedirs(thumbnails, exist_ok=True)
+
+    # Крупные порции задач уменьшают накладные расходы
+    # на передачу между процессами
+    chunksize = max(1, len(files) // (4 * (workers or os.cpu_count())))
+
+    with ProcessPoolExecutor(workers) as pool:
+        rows = list(pool.map(_analyze, files, [thumbnails] * len(files),
+                             [scale] * len(files), chunksize=chunksize))
+
+    width = max((len(f) for f in files), default=1)
+    dtype = np.dtype([
+        ("file", f"U{width}"),
+        ("height", np.int32),
+        ("width", np.int32),
+        ("channels", np.int8),
+        ("horizontal", np.float64),
+        ("vertical", np.float64),
+        ("channel_horizontal", np.float64, MAX_CHANNELS),
+        ("channel_vertical", np.float64, MAX_CHANNELS),
+    ])
+    return np.array(rows, dtype=dtype)
 
 
 def main() -> None:
@@ -29,19 +171,15 @@ def main() -> None:
     и оригинального изображения.
     """
     # Считаем синий канал оригинала.
-    blue_original = cv2.imread("Images/Lenna.png", 0)
-    # Получим только последний бит.
-    bin_original = (blue_original & 1)
-    # Преобразуем матрицу бит в массив бит.
-    bin_original = bin_original.ravel()[:]
+    blue_original = read_gray("Images/Lenna.png")
     # Для сравнения сгенерируем псевдослучайную
     # равномерно распределнную последовательность
     # бит, чтобы смоделировать стегосообщение.
-    bin_stego = np.random.randint(2, size=len(bin_original))
+    bin_stego = np.random.randint(2, size=blue_original.size)
     # Сравним 2 соседних бита у оригинального изображения
     # и промоделированного.
-    original_comparison = (bin_original[1:] == bin_original[:-1])
-    stego_comparison = (bin_stego[1:] == bin_stego[:-1])
+    original_comparison = lsb_comparison(blue_original)
+    stego_comparison = lsb_comparison(bin_stego)
     # Посмотрим на получившееся распределение
     pretty_stat(original_comparison, "Original")
     pretty_stat(stego_comparison, "Stego")
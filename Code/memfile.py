@@ -0,0 +1,58 @@
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def path(data=b""):
+    """
+    Возвращает путь к файлу в памяти с содержимым data (байты или
+    объект с протоколом буфера), по которому его могут открыть
+    jpegio и PIL. Там, где нет memfd_create, используется
+    временный файл.
+    """
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("stego")
+
+        try:
+            # Файловый объект дописывает данные, даже если
+            # запись прошла не за один системный вызов
+            with open(fd, "wb", closefd=False) as f:
+                f.write(data)
+
+            yield f"/proc/self/fd/{fd}"
+
+        finally:
+            os.close(fd)
+
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(data)
+
+    try:
+        yield f.name
+
+    finally:
+        os.remove(f.name)
+
+
+def read(file_name: str) -> bytes:
+    """
+    Считывает файл целиком.
+    """
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def size(source) -> int:
+    """
+    Возвращает размер файла: по пути или файлоподобного объекта.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+
+    position = source.tell()
+    end = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return end
@@ -0,0 +1,92 @@
+import numpy as np
+
+# Число раундов сети Фейстеля
+ROUNDS = 4
+# Номера шифруются блоками такого размера: промежуточные
+# массивы раундов тогда помещаются в кэш процессора
+BLOCK = 1 << 16
+
+
+class Permutation:
+    """
+    Ключевая перестановка чисел 0, ..., size - 1. Образ любого
+    набора номеров вычисляется отдельно, без построения всей
+    перестановки: номер шифруется несбалансированной сетью
+    Фейстеля на ближайшем сверху пространстве из 2^w чисел,
+    а результаты вне диапазона шифруются повторно, пока
+    не попадут в него.
+    """
+
+    def __init__(self, size: int, seed: int) -> None:
+        """
+        Возвращает перестановку size чисел,
+        заданную порождающим элементом seed.
+        """
+        self.size = size
+        # Разрядность пространства, не меньше 2 бит,
+        # чтобы у обеих половин номера был хотя бы один бит
+        width = max(2, (size - 1).bit_length())
+        # Вычисления в 32-битных числах вдвое дешевле
+        self._dtype = np.uint32 if width <= 32 else np.uint64
+        bits = np.iinfo(self._dtype).bits
+        self._low = self._dtype(width // 2)
+        self._masks = (self._dtype((1 << (width - width // 2)) - 1),
+                       self._dtype((1 << (width // 2)) - 1))
+        # Константы перемешивания, как в хеше Murmur3
+        self._mix = (self._dtype(0x9E3779B1), self._dtype(0x85EBCA6B))
+        self._shifts = (self._dtype(bits // 2 - 1), self._dtype(13))
+        self._keys = np.random.default_rng(seed).integers(
+            0, 1 << bits, ROUNDS, dtype=self._dtype)
+
+    def _round(self, half: np.array, key, mask) -> np.array:
+        """
+        Раундовая функция: перемешивает половину номера с ключом.
+        """
+        x = half ^ key
+        x *= self._mix[0]
+        x ^= x >> self._shifts[0]
+        x *= self._mix[1]
+        x ^= x >> self._shifts[1]
+        x &= mask
+        return x
+
+    def _encrypt(self, index: np.array) -> np.array:
+        """
+        Шифрует номера сетью Фейстеля на 2^w числах. Раунды по
+        очереди изменяют старшую и младшую половины номера,
+        поэтому половины могут быть разной длины.
+        """
+        high, low = index >> self._low, index & self._masks[1]
+
+        for i, key in enumerate(self._keys):
+            if i % 2 == 0:
+                high ^= self._round(low, key, self._masks[0])
+
+            else:
+                low ^= self._round(high, key, self._masks[1])
+
+        high <<= self._low
+        high |= low
+        return high
+
+    def __call__(self, index: np.array) -> np.array:
+        """
+        Возвращает образы номеров index.
+        """
+        index = np.asarray(index, dtype=self._dtype)
+        result = np.empty(len(index), dtype=np.intp)
+        size = self._dtype(self.size)
+
+        for start in range(0, len(index), BLOCK):
+            block = self._encrypt(index[start:start + BLOCK])
+            # Пространство сети меньше 2 * size, поэтому в среднем
+            # повторно шифровать приходится не больше одного раза
+            outside = np.flatnonzero(block >= size)
+
+            while len(outside):
+                block[outside] = self._encrypt(block[outside])
+                outside = outside[block[outside] >= size]
+
+            result[start:start + BLOCK] = block
+
+        return result
@@ -1,4 +1,8 @@
+import io
+import os
 import numpy as np
+import instrument
+import memfile
 from lsb import LSB
 from PIL import Image
 
@@ -8,44 +12,142 @@ class PNG(LSB):
     Реализация алгоритма LSB для файлов формата PNG.
     """
 
-    def __init__(self, file_name: str, message: bytes = None) -> None:
+    def __init__(self, file_name: str, message: bytes = None,
+                 bits: int = 1, channels: tuple = None,
+                 seed: int = None) -> None:
         """
-        Возвращает простой PNG кодер,
-        принимает на вход имя файла и сообщение.
+        Возвращает простой PNG кодер, принимает на вход имя
+        файла (или файлоподобный объект) и сообщение.
+
+        Сообщение занимает bits младших бит каждого элемента.
+        Если задан кортеж channels, используются только эти
+        каналы изображения, например (2,) - только синий.
+        Если задан seed, сообщение рассеивается по контейнеру.
         """
         self._file_name = file_name
-        container = np.array(Image.open(file_name))
-        super().__init__(container, message)
+
+        with instrument.span("pil.open"):
+            container = np.array(Image.open(file_name))
+
+        if instrument.enabled():
+            instrument.count("bytes_read", memfile.size(file_name))
+
+        if channels is not None:
+            if container.ndim != 3:
+                raise ValueError("У изображения только один канал")
+
+            # Повторяющиеся каналы дали бы перекрывающиеся элементы
+            channels = sorted(set(channels))
+
+        self._channels = channels
+        super().__init__(container, message, bits, seed)
+
+    @classmethod
+    def from_bytes(cls, data, message: bytes = None, **kwargs):
+        """
+        Возвращает кодер для изображения, переданного байтами
+        или объектом с протоколом буфера.
+        """
+        stego = cls(io.BytesIO(data), message, **kwargs)
+        # Перезаписывать нечего, сохранять можно только через save_as
+        stego._file_name = None
+        return stego
+
+    def _size(self) -> int:
+        """
+        Возвращает число элементов контейнера.
+        """
+        if self._channels is None:
+            return self._container.size
+
+        return self._container.shape[0] * self._container.shape[1] * len(
+            self._channels)
+
+    def _locate(self, index) -> tuple:
+        """
+        Возвращает массив контейнера и индекс в нем для элементов
+        с номерами index: срезом или массивом номеров.
+        """
+        if self._channels is None:
+            # Элементы всех каналов идут в контейнере подряд
+            return (self._container.reshape(-1), index)
+
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(self._size()))
+
+        pixel, channel = np.divmod(index, len(self._channels))
+        rows, cols = np.unravel_index(pixel, self._container.shape[:2])
+        return (self._container,
+                (rows, cols, np.asarray(self._channels)[channel]))
+
+    def _gather(self, index) -> np.array:
+        """
+        Возвращает элементы с номерами index.
+        """
+        container, location = self._locate(index)
+        return container[location]
+
+    def _scatter(self, index, values: np.array) -> None:
+        """
+        Записывает values в элементы с номерами index.
+        """
+        container, location = self._locate(index)
+        container[location] = values
 
     def _to_elements(self) -> np.array:
         """
         Возвращает репрезентацию контейнера
         как последовательности элементов.
         """
-        return self._container.ravel()[:]
+        if self._channels is None:
+            return self._container.ravel()[:]
+
+        # Элементы выбранных каналов идут попиксельно
+        return self._container[..., self._channels].ravel()
 
     def _from_elements(self, elements: np.array) -> None:
         """
         Строит контейнер по последовательности
         элементов.
         """
-        self._container.ravel()[:] = elements
+        if self._channels is None:
+            self._container.ravel()[:] = elements
+            return
+
+        shape = self._container.shape[:2] + (len(self._channels),)
+        self._container[..., self._channels] = elements.reshape(shape)
 
     def save(self) -> None:
         """
         Перезаписывает исходный файл
         новый контейнером.
         """
-        image = Image.fromarray(self._container)
-        image.save(self._file_name)
+        if not isinstance(self._file_name, (str, os.PathLike)):
+            raise ValueError("Исходного файла нет, используйте save_as")
+
+        self.save_as(self._file_name)
 
     def save_as(self, file_name: str) -> None:
         """
         Сохраняет контейнер в файл,
         заданный параментром file_name.
         """
-        image = Image.fromarray(self._container)
-        image.save(file_name)
+        with instrument.span("pil.save"):
+            image = Image.fromarray(self._container)
+            # Формат задается явно: у пути может не быть
+            # расширения, например у файла в памяти
+            image.save(file_name, format="PNG")
+
+        if instrument.enabled():
+            instrument.count("bytes_written", memfile.size(file_name))
+
+    def to_bytes(self) -> bytes:
+        """
+        Возвращает контейнер в виде байт файла PNG.
+        """
+        buffer = io.BytesIO()
+        self.save_as(buffer)
+        return buffer.getvalue()
 
 
 def main() -> None:
@@ -53,18 +155,17 @@ def main() -> None:
     with open("Messages/Alice in wonderland.txt", "rb") as f:
         message = f.read()
 
-    # Запоминаем длину сообщения.
-    size = len(message)
     # Кодируем сообщение.
     png = PNG("Images/Lenna.png", message)
-    png.encode()
+    # Вместе с сообщением встраиваем его длину и контрольную сумму.
+    png.encode_framed()
     png.save_as("Images/LSB_Lenna.png")
     # Переоткрываем изображение.
     png = PNG("Images/LSB_Lenna.png")
-    # Декодируем сообщение.
-    decoded = png.decode()
+    # Декодируем сообщение, обрабатывая только занятые им элементы.
+    decoded = png.decode_framed()
     # Проверяем, что сообщения до и после совпадают.
-    new_message = decoded[:size]
+    new_message = decoded
     print(f"{new_message == message}")
 
 
@@ -0,0 +1,159 @@
+import shutil
+import numpy as np
+import instrument
+from lsb import LSB
+
+
+class Raw(LSB):
+    """
+    Реализация алгоритма LSB для несжатых изображений,
+    отображаемых в память: тела файлов PPM/PGM или
+    сырых плоскостей пикселей по заданному смещению.
+    """
+
+    def __init__(self, file_name: str, message: bytes = None,
+                 offset: int = None, shape: tuple = None,
+                 dtype=np.uint8, bits: int = 1,
+                 seed: int = None, writable: bool = True) -> None:
+        """
+        Возвращает простой кодер несжатых изображений,
+        принимает на вход имя файла и сообщение.
+
+        По умолчанию файл считается изображением PPM/PGM и его
+        заголовок разбирается автоматически. Для сырых данных
+        задаются смещение offset от начала файла, форма shape
+        и тип dtype элементов. Сообщение занимает bits младших
+        бит каждого элемента. Если задан seed, сообщение
+        рассеивается по контейнеру. Если writable ложно, файл
+        открывается только для чтения и встраивать нельзя.
+        """
+        self._file_name = file_name
+
+        if offset is None:
+            offset, shape, dtype = self._netpbm_header(file_name)
+
+        # Встраивание изменяет сам файл, поэтому по умолчанию
+        # он открывается на запись
+        mode = "r+" if writable else "r"
+        # Отображаем пиксели в память: страницы файла читаются
+        # и записываются только при обращении к ним
+        container = np.memmap(file_name, dtype=dtype, mode=mode,
+                              offset=offset, shape=shape)
+        super().__init__(container, message, bits, seed)
+
+    @staticmethod
+    def _netpbm_header(file_name: str) -> tuple:
+        """
+        Разбирает заголовок двоичного файла PPM (P6) или PGM (P5).
+        Возвращает смещение пикселей, их форму и тип.
+        """
+        tokens = []
+
+        with open(file_name, "rb") as f:
+            # Заголовок состоит из сигнатуры, ширины, высоты и
+            # максимального значения, между которыми могут быть
+            # пробельные символы и комментарии
+            while len(tokens) < 4:
+                c = f.read(1)
+
+                if not c:
+                    raise ValueError("Неполный заголовок PPM/PGM")
+
+                if c == b"#":
+                    f.readline()
+
+                elif c.isspace():
+                    continue
+
+                else:
+                    token = c
+
+                    while True:
+                        c = f.read(1)
+
+                        if not c or c.isspace():
+                            break
+
+                        token += c
+
+                    tokens.append(token)
+
+            # После максимального значения идет ровно один пробельный
+            # символ, который уже прочитан
+            offset = f.tell()
+
+        magic, width, height, maxval = tokens
+
+        if magic not in (b"P5", b"P6"):
+            raise ValueError("Поддерживаются только форматы P5 и P6")
+
+        width, height, maxval = int(width), int(height), int(maxval)
+        shape = (height, width) if magic == b"P5" else (height, width, 3)
+        # Двухбайтовые значения хранятся в порядке big-endian
+        dtype = np.uint8 if maxval < 256 else np.dtype(">u2")
+        return offset, shape, dtype
+
+    def _to_elements(self) -> np.array:
+        """
+        Возвращает репрезентацию контейнера
+        как последовательности элементов.
+        Данные не копируются.
+        """
+        return self._container.reshape(-1)
+
+    def _from_elements(self, elements: np.array) -> None:
+        """
+        Строит контейнер по последовательности
+        элементов.
+        """
+        # Элементы, полученные из _to_elements, уже изменяют
+        # файл на месте, копировать их не нужно
+        if not np.may_share_memory(elements, self._container):
+            self._container.reshape(-1)[:] = elements
+
+    def save(self) -> None:
+        """
+        Сбрасывает измененные страницы в исходный файл.
+        """
+        with instrument.span("memmap.flush"):
+            self._container.flush()
+
+    def save_as(self, file_name: str) -> None:
+        """
+        Сохраняет контейнер в файл, заданный параментром
+        file_name. Встраивание изменяет исходный файл
+        через отображение в память, поэтому после
+        сохранения он совпадает с file_name.
+        """
+        self.save()
+        shutil.copyfile(self._file_name, file_name)
+
+
+def main() -> None:
+    """
+    Проверяет работоспособность программы.
+    """
+    from PIL import Image
+
+    # Считываем сообщение.
+    with open("Messages/Alice in wonderland.txt", "rb") as f:
+        message = f.read()
+
+    # Запоминаем длину сообщения.
+    size = len(message)
+    # Получаем несжатый контейнер.
+    Image.open("Images/Lenna.png").convert("RGB").save("Images/Lenna.ppm")
+    # Кодируем сообщение прямо в файле.
+    raw = Raw("Images/Lenna.ppm", message)
+    raw.encode()
+    raw.save()
+    # Переоткрываем изображение.
+    raw = Raw("Images/Lenna.ppm")
+    # Декодируем сообщение.
+    decoded = raw.decode(size)
+    # Проверяем, что сообщения до и после совпадают.
+    print(f"{decoded == message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,23 @@
+import os
 import numpy as np
 import jpegio as jio
 import random
+import frame
+import instrument
+import memfile
+import varint
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import as_strided
+
+# Форматы ключа позиций, записываемые в его первый байт: битовая
+# маска всех блоков, длины серий маски и номера занятых блоков.
+# Ключ без этого байта - маска в исходном формате, ее длина
+# всегда ровно ceil(число блоков / 8) байт
+KEY_MASK, KEY_RUNS, KEY_USED = 0, 1, 2
+KEY_FORMATS = {"mask": KEY_MASK, "runs": KEY_RUNS, "used": KEY_USED}
+# Старший бит байта формата: тройки коэффициентов порождены
+# numpy.random.Generator, а не модулем random
+KEY_NUMPY = 0x80
 
 
 class BMYY():
@@ -9,18 +26,43 @@ class BMYY():
     """
 
     def __init__(self, file_name: str, message: bytes = None,
-                 seed: int = 0) -> None:
+                 seed: int = 0, compat: bool = False, P: float = 3,
+                 Pl: int = 210, Ph: int = 40, index=None,
+                 channels: tuple = (0,), quant_aware: bool = False,
+                 workers: int = None) -> None:
         """
         Принимает на вход путь до файла с изображением file_path,
         байтовое сообщение message и попрождающий элемент seed,
-        используемый для инициализации ГПСЧ. Возвращает простой
+        используемый для инициализации ГПСЧ. Флаг compat включает
+        при встраивании генерацию коэффициентов через модуль random,
+        как в исходной реализации; ГПСЧ записывается в ключ позиций,
+        и при извлечении берется из него. P, Pl и Ph - пороги
+        различения, яркости и монотонности. Индекс емкости index
+        (CapacityIndex), если задан, избавляет от поиска подходящих
+        блоков в уже встречавшихся изображениях. Возвращает простой
         в использовании JPEG кодер.
+
+        channels - номера компонент JPEG (0 - Y, 1 - Cb, 2 - Cr),
+        подходящие блоки которых заполняются сообщением по очереди.
+        Пороги P, Pl и Ph можно задать последовательностями,
+        по одному значению на канал. Если quant_aware истинно,
+        пороги задаются в единицах деквантованных коэффициентов
+        и пересчитываются по таблице квантования канала. Каналы
+        обрабатываются параллельно workers потоками, по
+        умолчанию - по потоку на канал.
         """
         self._file_name = file_name
+        # Контейнер, по которому индекс емкости ищет маску
+        self._source = file_name
         # Считываем ДКП коэффициенты
-        self._dct = jio.read(self._file_name)
-        # Считываем канал яркости.
-        self._container = self._dct.coef_arrays[0]
+        with instrument.span("jio.read"):
+            self._dct = jio.read(self._file_name)
+
+        if instrument.enabled():
+            instrument.count("bytes_read", os.path.getsize(file_name))
+        # Считываем выбранные каналы, по умолчанию - только яркость
+        self._channels = tuple(channels)
+        self._containers = [self._dct.coef_arrays[c] for c in self._channels]
 
         if message is None:
             self.message = []
@@ -28,8 +70,9 @@ class BMYY():
         else:
             self.message = message
 
-        # Сохраняем seed
+        # Сохраняем seed и режим ГПСЧ
         self.seed = seed
+        self.compat = compat
         # Коэффициенты для встраивания
         self._stego_coef = [(i, j) for i in range(8) for j in range(8)
                             if i + j < 5 and (i, j) != (0, 0)]
@@ -45,173 +88,531 @@ class BMYY():
         ).reshape(8, 8)
 
         # Сохраняем порог различения
-        self._P = 3
+        self._P = P
         # Сохраняем порог яркости
-        self._Pl = 210
+        self._Pl = Pl
         # Сохраняем порог монотонности
-        self._Ph = 40
+        self._Ph = Ph
+        # Сохраняем индекс емкости
+        self._index = index
+        # Пороги в единицах деквантованных коэффициентов
+        self._quant_aware = quant_aware
+        # Число потоков обработки каналов
+        self._workers = workers
+        # Число блоков, измененных последним обновлением
+        self.changed = 0
+        # Емкость, найденная при просмотре контейнера
+        self._capacity = None
+
+    def suitable_mask(self, Pl=None, Ph=None) -> np.array:
+        """
+        Возвращает маску подходящих блоков формы (h // 8, w // 8),
+        а для нескольких каналов - одномерную маску, в которой
+        маски каналов идут подряд. Пороги Pl и Ph по умолчанию
+        берутся из кодера, их можно переопределить, не
+        перечитывая изображение.
+        """
+        Pl = self._Pl if Pl is None else Pl
+        Ph = self._Ph if Ph is None else Ph
+
+        # Индекс хранит маски только канала яркости без пересчета
+        # порогов, а обращаться к нему можно лишь из этого потока
+        if (self._index is not None and self._channels == (0,)
+                and not self._quant_aware):
+            return self._index.mask(self._source, Pl, Ph,
+                                    self._scan_mask)
+
+        masks = self._map(
+            lambda i: self._scan_mask(self._param(Pl, i),
+                                      self._param(Ph, i), i),
+            range(len(self._channels)))
+
+        if len(masks) == 1:
+            return masks[0]
 
-    def _is_suitable_block(self, block: np.array) -> bool:
-        # Проверяем блок на порог яркости и монотонности
-        l = np.absolute(block[self._low_coef].sum())
-        h = np.absolute(block[self._high_coef].sum())
-        # return True
-        return l >= self._Pl and h <= self._Ph
+        return np.concatenate([mask.ravel() for mask in masks])
 
-    def _encode_block(self, block: np.array, bit: bool) -> np.array:
+    def _scan_mask(self, Pl: int, Ph: int, channel: int = 0) -> np.array:
         """
-        В данном блоке block кодирует bit за счет
-        изминения соотношения между тремя псевдослучайными
-        элементами.
+        Вычисляет маску подходящих блоков для порогов Pl и Ph
+        в канале с порядковым номером channel.
         """
-        # С помощью ГПСЧ выбираем случайные элементы блока
-        k1, k2, k3 = random.sample(self._stego_coef, 3)
+        blocks = self._blocks(self._containers[channel], 8, 8)
+
+        # Проверяем все блоки сразу на порог яркости и монотонности
+        with instrument.span("bmyy.scan"):
+            if self._quant_aware:
+                # Суммы деквантованных коэффициентов: каждый
+                # коэффициент умножается на свой шаг квантования
+                q = self._quant(channel).astype(np.int64)
+                l = np.absolute(np.einsum("rcij,ij->rc", blocks,
+                                          q * self._low_coef))
+                h = np.absolute(np.einsum("rcij,ij->rc", blocks,
+                                          q * self._high_coef))
 
-        # Кодируем ноль, устанавливая block[k3] минимальным
-        # из трех элементов так, чтобы это соотношение
-        # сохранилось после квантования коэффициентов
-        if bit == False:
-            m = min(block[k1], block[k2])
-            block[k3] = m - self._P / 2
+            else:
+                l = np.absolute(blocks.sum(axis=(2, 3), dtype=np.int64,
+                                           where=self._low_coef))
+                h = np.absolute(blocks.sum(axis=(2, 3), dtype=np.int64,
+                                           where=self._high_coef))
 
-            if block[k1] == m:
-                block[k1] += self._P / 2
+        instrument.count("blocks_scanned", l.size)
+        return (l >= Pl) & (h <= Ph)
 
-            else:
-                block[k2] += self._P / 2
+    def _param(self, value, channel: int):
+        """
+        Возвращает порог value для канала с порядковым номером
+        channel: число или элемент последовательности порогов.
+        """
+        return value[channel] if np.ndim(value) else value
 
-        # Кодируем единицу, устанавливая block[k3] максимальным
-        # из трех элементов так, чтобы это соотношение
-        # сохранилось после квантовая коэффициентов
-        else:
-            m = max(block[k1], block[k2])
-            block[k3] = m + self._P / 2
+    def _quant(self, channel: int) -> np.array:
+        """
+        Возвращает таблицу квантования 8x8 канала
+        с порядковым номером channel.
+        """
+        info = self._dct.comp_info[self._channels[channel]]
+        return np.asarray(self._dct.quant_tables[info.quant_tbl_no])
+
+    def _half(self, channel: int, triples: np.array):
+        """
+        Возвращает запас, на который расходятся коэффициенты
+        triples в канале channel: половину порога различения.
+        С учетом квантования порог делится на шаг каждого
+        коэффициента, но запас не меньше единицы, иначе
+        отбрасывание дробной части стерло бы изменение.
+        """
+        P = self._param(self._P, channel)
 
-            if block[k1] == m:
-                block[k1] -= self._P / 2
+        if not self._quant_aware:
+            return P / 2
 
-            else:
-                block[k2] -= self._P / 2
+        q = self._quant(channel).ravel()
+        return np.maximum(P / (2 * q), 1)[triples]
+
+    def _map(self, func, items) -> list:
+        """
+        Применяет func к каждому из items. Для нескольких каналов
+        вычисления идут в пуле потоков: numpy отпускает GIL на время
+        операций над массивами, и каналы обрабатываются одновременно.
+        """
+        items = list(items)
+
+        if len(items) < 2 or self._workers == 1:
+            return [func(item) for item in items]
 
-        return block
+        with ThreadPoolExecutor(self._workers or len(items)) as pool:
+            return list(pool.map(func, items))
+
+    def _channel_blocks(self) -> list:
+        """
+        Возвращает представления self._blocks всех каналов.
+        """
+        return [self._blocks(c, 8, 8) for c in self._containers]
 
-    def _decode_block(self, block: np.array) -> bool:
+    def _per_channel(self, func, blocks: list, index: np.array,
+                     *arrays) -> list:
         """
-        Для данного блока block декодирует
-        bit, закодированный с помощью соотношения
-        между тремя псевдослучайными элементами
+        Разбивает сквозные возрастающие номера блоков index и
+        соответствующие им строки arrays по каналам и вызывает
+        func(channel, blocks[channel], номера в канале, *строки)
+        для каждого канала. Возвращает результаты по каналам.
         """
-        # С помощью ГПСЧ выбираем случайные элементы блока
-        k1, k2, k3 = random.sample(self._stego_coef, 3)
-        # Находим максимум разницы между третьим
-        # и двумя остальными элементами
-        M = max(block[k1], block[k2], block[k3])
+        sizes = [b.shape[0] * b.shape[1] for b in blocks]
+        # Номер первого блока каждого канала в сквозной нумерации
+        offsets = np.cumsum([0] + sizes)
+        bounds = np.searchsorted(index, offsets)
+        tasks = []
 
-        if block[k3] == M:
-            return True
+        for i in range(len(blocks)):
+            part = slice(bounds[i], bounds[i + 1])
+            tasks.append((i, blocks[i], index[part] - offsets[i])
+                         + tuple(a[part] for a in arrays))
+
+        return self._map(lambda task: func(*task), tasks)
+
+    def capacity(self) -> int:
+        """
+        Возвращает емкость исходного контейнера в байтах. После
+        встраивания она известна по найденным им блокам, и
+        контейнер заново не просматривается.
+        """
+        if self._capacity is None:
+            self._capacity = np.count_nonzero(self.suitable_mask()) // 8
+
+        return self._capacity
+
+    def _triples(self, n: int, compat: bool) -> np.array:
+        """
+        Возвращает массив формы (n, 3) плоских индексов коэффициентов
+        блока 8x8, выбранных ГПСЧ для n блоков подряд.
+
+        В режиме совместимости compat воспроизводит последовательность
+        вызовов random.sample исходной реализации, поэтому ранее
+        закодированные файлы декодируются без изменений. Иначе все
+        тройки генерируются одним вызовом numpy.random.Generator.
+        """
+        # Плоские индексы коэффициентов для встраивания
+        coef = np.array([i * 8 + j for (i, j) in self._stego_coef])
+        instrument.count("triples_generated", n)
+
+        if compat:
+            # Индексы, выбираемые random.sample, не зависят от
+            # содержимого выборки, поэтому достаточно выбирать из range.
+            # Собственный генератор не сбрасывает общее состояние random
+            generator = random.Random(self.seed)
+            population = range(len(coef))
+            choice = np.array([generator.sample(population, 3)
+                               for _ in range(n)], dtype=np.intp)
 
         else:
-            return False
+            # Для каждого блока выбираем 3 различных коэффициента
+            # как первые 3 позиции случайной перестановки
+            rng = np.random.default_rng(self.seed)
+            keys = rng.random((n, len(coef)))
+            choice = np.argpartition(keys, 3, axis=1)[:, :3]
+            # Порядок выбранных argpartition не определен, а от него
+            # зависят роли k1, k2 и k3, поэтому упорядочиваем тройку
+            # по ключам, как в самой перестановке
+            order = np.argsort(np.take_along_axis(keys, choice, axis=1),
+                               axis=1, kind="stable")
+            choice = np.take_along_axis(choice, order, axis=1)
+
+        return coef[choice.reshape(n, 3)]
+
+    def _coefficients(self, blocks: np.array, index: np.array,
+                      triples: np.array) -> tuple:
+        """
+        Возвращает индекс в представлении blocks для коэффициентов
+        triples[i] блоков с плоскими номерами index[i].
+        """
+        w = blocks.shape[1]
+        rows, cols = np.divmod(index, w)
+        i, j = np.divmod(triples, 8)
+        return rows[:, None], cols[:, None], i, j
+
+    def _encode_blocks(self, blocks: np.array, index: np.array,
+                       bits: np.array, triples: np.array,
+                       half) -> None:
+        """
+        В каждом блоке с номером index[i] кодирует bits[i] за счет
+        изменения соотношения между тремя элементами triples[i].
+        half - запас расхождения, число или массив формы triples.
+        Блоки изменяются на месте.
+        """
+        coef = self._coefficients(blocks, index, triples)
+        # Значения трех выбранных коэффициентов каждого блока
+        k = blocks[coef].astype(np.float64)
+        a, b = k[:, 0], k[:, 1]
+        bits = bits.astype(bool)
+        half = np.broadcast_to(half, k.shape)
+        # Для нуля block[k3] становится меньше минимума из двух
+        # других элементов, для единицы - больше их максимума,
+        # причем с запасом, переживающим квантование
+        m = np.where(bits, np.maximum(a, b), np.minimum(a, b))
+        sign = np.where(bits, 1.0, -1.0)
+        k[:, 2] = m + sign * half[:, 2]
+        # Экстремальный из двух элементов сдвигаем навстречу,
+        # при равенстве - первый из них
+        first = a == m
+        k[:, 0] = np.where(first, a - sign * half[:, 0], a)
+        k[:, 1] = np.where(first, b, b - sign * half[:, 1])
+        # Приведение к целому типу отбрасывает дробную часть,
+        # как и при поэлементном присваивании
+        blocks[coef] = np.trunc(k).astype(blocks.dtype)
+
+    def _decode_blocks(self, blocks: np.array, index: np.array,
+                       triples: np.array) -> np.array:
+        """
+        Для каждого блока с номером index[i] декодирует
+        бит, закодированный с помощью соотношения
+        между тремя элементами triples[i].
+        """
+        k = blocks[self._coefficients(blocks, index, triples)]
+        # Единица, если третий элемент - максимальный из трех
+        return k[:, 2] == k.max(axis=1)
 
-    def _blockshaped(self, arr: np.array, nrows: int, ncols: int) -> np.array:
+    def _blocks(self, arr: np.array, nrows: int, ncols: int) -> np.array:
         """
-        Возвращает массив формы (n, nrows, ncols), где
-        n * nrows * ncols = arr.size
+        Возвращает представление матрицы arr формы
+        (h // nrows, w // ncols, nrows, ncols), где элемент [r, c]
+        - это подматрица в r-й строке и c-м столбце разбиения.
 
-        Если массив - это матрица, тогда возвращает массив,
-        выглядещий как разбиение этой матрицы на подматрицы.
+        Данные не копируются: запись в представление
+        изменяет исходную матрицу.
         """
         h, w = arr.shape
-        return (arr.reshape(h//nrows, nrows, -1, ncols)
-                   .swapaxes(1, 2)
-                   .reshape(-1, nrows, ncols))
+        s0, s1 = arr.strides
+        return as_strided(arr, shape=(h // nrows, w // ncols, nrows, ncols),
+                          strides=(nrows * s0, ncols * s1, s0, s1))
+
+    def encode(self, positions: bytes = None, key: str = "mask") -> bytes:
+        """
+        Кодирует сообщение в контейнер и возвращает позиции подходящих блоков
+        в формате key (см. _key). Если переданы позиции positions прошлого
+        встраивания, сообщение обновляется: изменяются только блоки, бит
+        которых отличается, а возвращаются те же позиции.
+        """
+        return self._embed(self.message, positions, key)
 
-    def _unblockshaped(self, arr: np.array, h: int, w: int) -> np.array:
+    def encode_framed(self, positions: bytes = None,
+                      key: str = "mask") -> bytes:
         """
-        Возвращает матрицу формы (h, w), где
-        h * w = arr.size
+        Кодирует сообщение в контейнер вместе с заголовком,
+        содержащим длину сообщения и его контрольную сумму.
+        Возвращает позиции подходящих блоков в формате key.
+        Если переданы позиции positions прошлого встраивания,
+        сообщение обновляется, как в encode.
+        """
+        return self._embed(frame.pack(self.message), positions, key)
+
+    def _key(self, mask: np.array, used: np.array, key: str) -> bytes:
+        """
+        Возвращает ключ позиций в формате key: "mask" - битовая
+        маска всех блоков изображения, "runs" - длины чередующихся
+        серий неподходящих и подходящих блоков маски, "used" - номера
+        только блоков, занятых сообщением, "auto" - самый короткий
+        из трех. Числа хранятся в формате varint.
+        """
+        if key == "auto":
+            return min((self._key(mask, used, k) for k in KEY_FORMATS),
+                       key=len)
+
+        if key not in KEY_FORMATS:
+            raise ValueError(f"Неизвестный формат ключа {key}")
+
+        if key == "mask":
+            data = np.packbits(mask).tobytes()
 
-        Если матрица формы (n, nrows, ncols), где n - это подматрицы
-        формы (nrows, ncols), тогда возвращает матрицу, составленную
-        из этих подматриц.
+        elif key == "runs":
+            # Серии начинаются с неподходящих блоков,
+            # первая серия может быть пустой
+            edges = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+            runs = np.diff(np.concatenate([[0], edges, [len(mask)]]))
+
+            if len(mask) and mask[0]:
+                runs = np.concatenate([[0], runs])
+
+            data = varint.encode(runs)
+
+        else:
+            # Номера возрастают, поэтому разности соседних
+            # номеров без единицы неотрицательны и малы
+            data = varint.encode(np.concatenate(
+                [[len(used)], np.diff(used, prepend=-1) - 1]))
+
+        fmt = KEY_FORMATS[key] | (0 if self.compat else KEY_NUMPY)
+        positions = bytes([fmt]) + data
+
+        # Длина ключа не должна совпадать с длиной маски без байта
+        # формата: лишний нулевой байт в конце серий и номеров
+        # при чтении не учитывается
+        if len(positions) == -(-len(mask) // 8):
+            positions += b"\0"
+
+        return positions
+
+    def _key_index(self, positions: bytes, size: int,
+                   count: int = None) -> tuple:
+        """
+        Возвращает номера подходящих блоков из ключа positions
+        любого формата, если задано count - только первые count,
+        и признак генерации троек модулем random.
         """
-        n, nrows, ncols = arr.shape
-        return (arr.reshape(h//nrows, -1, nrows, ncols)
-                   .swapaxes(1, 2)
-                   .reshape(h, w))
+        positions = bytes(positions)
+
+        # Маска в исходном формате, без байта формата,
+        # записана исходной реализацией через random
+        if len(positions) == -(-size // 8):
+            fmt, data, compat = KEY_MASK, positions, True
+
+        else:
+            fmt, data = positions[0] & ~KEY_NUMPY, positions[1:]
+            compat = not positions[0] & KEY_NUMPY
+
+        if fmt == KEY_MASK:
+            mask = np.unpackbits(np.frombuffer(data, np.uint8))[:size]
 
-    def encode(self) -> bytes:
+        elif fmt == KEY_RUNS:
+            runs = varint.decode(data).astype(np.intp)
+            # Нечетные серии состоят из подходящих блоков
+            mask = np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+
+        elif fmt == KEY_USED:
+            values = varint.decode(data, None if count is None
+                                   else count + 1).astype(np.intp)
+
+            if len(values) == 0:
+                raise ValueError("Ключ не содержит номеров блоков")
+
+            deltas = values[1:1 + values[0]]
+            return np.cumsum(deltas + 1)[:count] - 1, compat
+
+        else:
+            raise ValueError(f"Неизвестный формат ключа {fmt}")
+
+        if len(mask) != size:
+            raise ValueError("Ключ не соответствует контейнеру")
+
+        return np.flatnonzero(mask)[:count], compat
+
+    def _embed(self, message: bytes, positions: bytes = None,
+               key: str = "mask") -> bytes:
         """
-        Кодирует сообщение в контейнер и возвращает позиции подходящих блоков.
+        Кодирует message в контейнер и возвращает позиции подходящих блоков.
         """
-        # Инициализируем ГПСЧ
-        random.seed(self.seed)
-        # Разбиваем массив ДКП коэффициентов на блоки
-        blocks = self._blockshaped(self._container, 8, 8)
-        # Находим положение подходящих блоков
-        mask = np.array([self._is_suitable_block(block) for block in blocks])
-        # В подходящих блоках меняем соотношения коэффициентов
-        suitable_blocks = blocks[mask]
+        # Разбиваем массивы ДКП коэффициентов на блоки
+        blocks = self._channel_blocks()
+
+        if positions is None:
+            # Находим положение подходящих блоков
+            mask = self.suitable_mask().ravel()
+            index = np.flatnonzero(mask)
+            compat = self.compat
+
+            if self._capacity is None:
+                self._capacity = len(index) // 8
+
+        else:
+            # При обновлении блоки уже найдены, и весь
+            # контейнер заново не просматривается
+            size = sum(b.shape[0] * b.shape[1] for b in blocks)
+            index, compat = self._key_index(positions, size)
+
         # Преобразуем сообщение в бинарный вид
         np_message = np.unpackbits(np.frombuffer(
-            self.message, dtype=np.uint8)).ravel()
+            message, dtype=np.uint8)).ravel()
         # Находим длину сообщения
         n = len(np_message)
-        # Кодируем сообщение
-        encoded_blocks = []
-
-        for i in range(n):
-            encoded_blocks.append(self._encode_block(
-                suitable_blocks[i], np_message[i]))
-
-        # Перезаписываем подходящие блоки
-        suitable_blocks[:n] = np.array(encoded_blocks)
-        blocks[mask] = suitable_blocks
-        # Соединяем блоки обратно в контейнер
-        self._container = self._unblockshaped(blocks, *self._container.shape)
-        # Сохраняем информацию в изображение
-        self._dct.coef_arrays[0].ravel()[:] = self._container.ravel()
+
+        if n > len(index):
+            raise ValueError("Сообщение не помещается в контейнер")
+
+        with instrument.span("bmyy.triples"):
+            triples = self._triples(n, compat)
+
+        index = used = index[:n]
+
+        if positions is not None:
+            # Перекодируем только блоки, бит которых отличается:
+            # повторное кодирование того же бита лишь искажало
+            # бы коэффициенты
+            with instrument.span("bmyy.decode_blocks"):
+                current = np.concatenate(self._per_channel(
+                    lambda c, b, i, t: self._decode_blocks(b, i, t),
+                    blocks, index, triples))
+
+            changed = np.flatnonzero(current != np_message.astype(bool))
+            index, np_message = index[changed], np_message[changed]
+            triples = triples[changed]
+            self.changed = len(changed)
+            instrument.count("blocks_changed", len(changed))
+
+        # Кодируем сообщение во все блоки каждого канала сразу,
+        # изменения записываются прямо в коэффициенты изображения
+        with instrument.span("bmyy.encode_blocks"):
+            self._per_channel(
+                lambda c, b, i, bits, t: self._encode_blocks(
+                    b, i, bits, t, self._half(c, t)),
+                blocks, index, np_message, triples)
+
+        instrument.count("bits_embedded", n)
+
+        # При обновлении позиции не меняются
+        if positions is not None:
+            return bytes(positions)
+
         # Возвращаем позиции встраивания
-        return np.packbits(mask).tobytes()
+        return self._key(mask, used, key)
 
-    def decode(self, positions: bytes) -> bytes:
+    def decode(self, positions: bytes, n_bytes: int = None,
+               offset: int = 0) -> bytes:
         """
-        Декодирует сообщение из контейнера
+        Декодирует n_bytes байт сообщения из контейнера, начиная
+        с байта offset, по умолчанию - из всех подходящих блоков.
         """
-        # Инициализируем ГПСЧ
-        random.seed(self.seed)
-        # Разбиваем массив ДКП коэффициентов на блоки
-        blocks = self._blockshaped(self._container, 8, 8)
-        message = []
-        # Находим позиции подходящих блоков
-        mask = np.unpackbits(np.frombuffer(positions, np.uint8)).astype(bool)
-        # Находим подходящие блоки
-        suitable_blocks = blocks[mask[:len(blocks)]]
-
-        # Декодируем сообщение
-        for block in suitable_blocks:
-            # Декодируем бит
-            bit = self._decode_block(block)
-            message.append(bit)
-
+        # Разбиваем массивы ДКП коэффициентов на блоки
+        blocks = self._channel_blocks()
+        size = sum(b.shape[0] * b.shape[1] for b in blocks)
+        # Находим позиции подходящих блоков, обрабатывая
+        # только блоки, несущие запрошенные байты
+        count = None if n_bytes is None else 8 * (offset + n_bytes)
+        index, compat = self._key_index(positions, size, count)
+
+        # ГПСЧ генерирует тройки с начала сообщения,
+        # лишние тройки отбрасываем
+        with instrument.span("bmyy.triples"):
+            triples = self._triples(len(index), compat)[8 * offset:]
+
+        index = index[8 * offset:]
+
+        # Декодируем сообщение из всех блоков каждого канала сразу
+        with instrument.span("bmyy.decode_blocks"):
+            message = np.concatenate(self._per_channel(
+                lambda c, b, i, t: self._decode_blocks(b, i, t),
+                blocks, index, triples))
+
+        instrument.count("bits_extracted", len(index))
         # Из бит собираем исходное сообщение
         message = np.packbits(message)
         # Преобразуем его в байты
         return message.tobytes()
 
+    def decode_framed(self, positions: bytes) -> bytes:
+        """
+        Декодирует сообщение, закодированное вместе с заголовком.
+        Обрабатываются только блоки, занятые заголовком
+        и самим сообщением.
+        """
+        header = self.decode(positions, frame.HEADER_SIZE)
+        length, crc = frame.parse(header)
+        message = self.decode(positions, length, frame.HEADER_SIZE)
+        return frame.check(message, crc)
+
+    @classmethod
+    def from_bytes(cls, data, message: bytes = None, **kwargs):
+        """
+        Возвращает кодер для изображения, переданного байтами
+        или объектом с протоколом буфера. jpegio читает файл
+        в памяти, коэффициенты остаются в кодере.
+        """
+        with memfile.path(data) as file_name:
+            stego = cls(file_name, message, **kwargs)
+
+        # Файл в памяти уже закрыт: сохранять можно только через
+        # save_as, а индекс емкости ищет маску по хэшу байт
+        stego._file_name = None
+        stego._source = data
+        return stego
+
     def save(self) -> None:
         """
         Перезаписывает исходный файл
         новый контейнером.
         """
-        jio.write(self._dct, self._file_name)
+        if self._file_name is None:
+            raise ValueError("Исходного файла нет, используйте save_as")
+
+        self.save_as(self._file_name)
 
     def save_as(self, file_name: str) -> None:
         """
         Сохраняет контейнер в файл,
         заданный параментром file_name.
         """
-        jio.write(self._dct, file_name)
+        with instrument.span("jio.write"):
+            jio.write(self._dct, file_name)
+
+        if instrument.enabled():
+            instrument.count("bytes_written", os.path.getsize(file_name))
+
+    def to_bytes(self) -> bytes:
+        """
+        Возвращает контейнер в виде байт файла JPEG.
+        """
+        with memfile.path() as file_name:
+            self.save_as(file_name)
+            return memfile.read(file_name)
 
 
 def main() -> None:
@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import urllib.parse
+import coders
+import instrument
+import memfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _embed_job(method: str, container: bytes, message: bytes,
+               options: dict) -> tuple:
+    """
+    Встраивает сообщение с заголовком в контейнер, переданный
+    байтами. Возвращает байты результата и позиции блоков BMYY.
+    Выполняется в процессе-исполнителе.
+    """
+    stego = coders.from_bytes(method, container, message, **options)
+    positions = coders.encode_framed(method, stego)
+    return stego.to_bytes(), positions
+
+
+def _extract_job(method: str, container: bytes, positions: bytes,
+                 options: dict) -> bytes:
+    """
+    Извлекает сообщение с заголовком из контейнера,
+    переданного байтами. Выполняется в процессе-исполнителе.
+    """
+    stego = coders.from_bytes(method, container, **options)
+    return coders.decode_framed(method, stego, positions)
+
+
+def _chi_job(container: bytes, channel: int, exclude: tuple,
+             curve: int):
+    """
+    Выполняет атаку хи-квадрат на контейнер, переданный байтами:
+    возвращает p-значение или, если curve больше нуля,
+    p-значения в curve точках. Выполняется в процессе-исполнителе.
+    """
+    import chi
+
+    with memfile.path(container) as source:
+        if curve:
+            return chi.chi_curve(source, curve, channel, exclude).tolist()
+
+        return chi.chi_attack(source, channel, exclude)
+
+
+def _init_worker(metrics: bool) -> None:
+    """
+    Инициализирует процесс-исполнитель: сбрасывает статистику,
+    унаследованную от основного процесса, и, если metrics
+    истинен, включает ее сбор.
+    """
+    instrument.reset()
+
+    if metrics:
+        instrument.enable()
+
+
+def _measured(job, *args) -> tuple:
+    """
+    Выполняет job(*args) в процессе-исполнителе и возвращает
+    результат вместе со статистикой instrument этой задачи.
+    """
+    return job(*args), instrument.drain()
+
+
+class Service:
+    """
+    Асинхронный интерфейс к кодерам и атаке хи-квадрат.
+    Вычисления выполняются пулом процессов, чтение и запись
+    файлов - пулом потоков, а семафоры ограничивают число
+    задач в работе: лишние вызовы ждут, не занимая память
+    очередями исполнителей.
+    """
+
+    def __init__(self, cpu_workers: int = None, io_workers: int = None,
+                 max_pending: int = None) -> None:
+        """
+        Возвращает сервис с cpu_workers процессами для вычислений
+        и io_workers потоками для файлов. Одновременно в работе
+        не более max_pending вычислительных задач.
+        """
+        cpu_workers = cpu_workers or os.cpu_count()
+        io_workers = io_workers or 4 * cpu_workers
+        # Исполнители собирают статистику, если она включена
+        # в основном процессе
+        self._cpu = ProcessPoolExecutor(
+            cpu_workers, initializer=_init_worker,
+            initargs=(instrument.enabled(),))
+        self._io = ThreadPoolExecutor(io_workers)
+        self._cpu_slots = asyncio.Semaphore(max_pending or 2 * cpu_workers)
+        self._io_slots = asyncio.Semaphore(io_workers)
+
+    async def _load(self, data) -> bytes:
+        """
+        Возвращает байты data. Если data - путь к файлу,
+        файл считывается в пуле потоков.
+        """
+        if not isinstance(data, str):
+            return data
+
+        async with self._io_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._io, memfile.read, data)
+
+    async def _compute(self, job, *args):
+        """
+        Выполняет job(*args) в пуле процессов. Статистика
+        instrument исполнителя добавляется к статистике сервиса.
+        """
+        async with self._cpu_slots:
+            loop = asyncio.get_running_loop()
+            result, stats = await loop.run_in_executor(
+                self._cpu, _measured, job, *args)
+
+        instrument.merge(stats)
+        return result
+
+    async def embed(self, method: str, container, message,
+                    **options) -> tuple:
+        """
+        Встраивает сообщение с заголовком в контейнер методом
+        method. Контейнер и сообщение - байты или пути к файлам.
+        Возвращает байты результата и позиции блоков BMYY
+        (None для остальных методов).
+        """
+        container, message = await asyncio.gather(
+            self._load(container), self._load(message))
+        return await self._compute(_embed_job, method, container,
+                                   message, options)
+
+    async def extract(self, method: str, container,
+                      positions: bytes = None, **options) -> bytes:
+        """
+        Извлекает сообщение с заголовком из контейнера методом
+        method. Для BMYY нужны позиции блоков positions.
+        """
+        if coders.positional(method) and positions is None:
+            raise ValueError("Для BMYY требуются позиции блоков")
+
+        container = await self._load(container)
+        return await self._compute(_extract_job, method, container,
+                                   positions, options)
+
+    async def chi(self, container, channel: int = 1, exclude: tuple = (),
+                  curve: int = 0):
+        """
+        Выполняет атаку хи-квадрат на JPEG контейнер.
+        """
+        container = await self._load(container)
+        return await self._compute(_chi_job, container, channel,
+                                   tuple(exclude), curve)
+
+    def close(self) -> None:
+        """
+        Останавливает пулы исполнителей.
+        """
+        self._cpu.shutdown()
+        self._io.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+
+# Сервис по умолчанию для функций модуля, создается при первом вызове
+_service = None
+
+
+def _default() -> Service:
+    """
+    Возвращает сервис по умолчанию.
+    """
+    global _service
+
+    if _service is None:
+        _service = Service()
+
+    return _service
+
+
+async def embed(method: str, container, message, **options) -> tuple:
+    """
+    Встраивает сообщение сервисом по умолчанию, см. Service.embed.
+    """
+    return await _default().embed(method, container, message, **options)
+
+
+async def extract(method: str, container, positions: bytes = None,
+                  **options) -> bytes:
+    """
+    Извлекает сообщение сервисом по умолчанию, см. Service.extract.
+    """
+    return await _default().extract(method, container, positions, **options)
+
+
+async def chi(container, channel: int = 1, exclude: tuple = (),
+              curve: int = 0):
+    """
+    Выполняет атаку хи-квадрат сервисом по умолчанию, см. Service.chi.
+    """
+    return await _default().chi(container, channel, exclude, curve)
+
+
+# Параметры кодеров, принимаемые в строке запроса
+_OPTIONS = ("bits", "seed")
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+async def _route(service: Service, path: str, query: dict, headers: dict,
+                 body: bytes) -> tuple:
+    """
+    Выполняет запрос и возвращает тело ответа и его заголовки.
+
+    POST /embed/<метод>: тело - контейнер, за которым следует
+    сообщение длины X-Message-Length. POST /extract/<метод>:
+    тело - контейнер. Позиции блоков BMYY передаются в
+    заголовке X-Positions в base64. POST /chi: тело - JPEG,
+    ответ - JSON с p-значением или кривой (параметр curve).
+    """
+    options = {k: int(v[0]) for k, v in query.items() if k in _OPTIONS}
+    parts = path.strip("/").split("/")
+
+    if parts[0] in ("embed", "extract") and len(parts) == 2:
+        method = parts[1]
+
+        if method not in coders.CODERS:
+            raise LookupError(method)
+
+        # Неподходящий параметр - ошибка запроса, а не сервера
+        coders.check_options(method, options)
+
+        if parts[0] == "embed":
+            length = int(headers.get("x-message-length", 0))
+
+            if not 0 <= length <= len(body):
+                raise ValueError("Неверная длина сообщения")
+
+            split = len(body) - length
+            stego, positions = await service.embed(
+                method, body[:split], body[split:], **options)
+            extra = {}
+
+            if positions is not None:
+                extra["X-Positions"] = base64.b64encode(positions).decode()
+
+            return stego, extra
+
+        positions = headers.get("x-positions")
+
+        if positions is not None:
+            positions = base64.b64decode(positions)
+
+        return await service.extract(method, body, positions,
+                                     **options), {}
+
+    if parts == ["chi"]:
+        result = await service.chi(
+            body, int(query.get("channel", ["1"])[0]),
+            tuple(int(v) for v in query.get("exclude", [])),
+            int(query.get("curve", ["0"])[0]))
+        return json.dumps(result).encode(), {
+            "Content-Type": "application/json"}
+
+    raise LookupError(path)
+
+
+def _metrics(query: dict) -> tuple:
+    """
+    Возвращает статистику instrument сервиса и его исполнителей
+    для GET /metrics: в текстовом формате Prometheus или, с
+    параметром format=json, в JSON, а с format=profile - отчет
+    cProfile (STEGO_INSTRUMENT=profile).
+    """
+    format = query.get("format", ["prometheus"])[0]
+
+    if format == "profile":
+        return instrument.profile().encode(), {"Content-Type": "text/plain"}
+    content = ("application/json" if format == "json"
+               else "text/plain; version=0.0.4")
+    return instrument.export(format).encode(), {"Content-Type": content}
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple:
+    """
+    Считывает запрос HTTP/1.1: возвращает метод, цель, заголовки
+    и тело или None, если клиент закрыл соединение. Неверный
+    запрос вызывает ValueError.
+    """
+    line = await reader.readline()
+
+    if not line.strip():
+        return None
+
+    verb, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return verb, target, headers, body
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int,
+                   payload: bytes, extra: dict) -> None:
+    """
+    Отправляет ответ с кодом status, телом payload
+    и дополнительными заголовками extra.
+    """
+    head = [f"HTTP/1.1 {status} {_REASONS[status]}",
+            f"Content-Length: {len(payload)}"]
+    head += [f"{name}: {value}" for name, value in extra.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+    await writer.drain()
+
+
+async def _handle(service: Service, reader: asyncio.StreamReader,
+                  writer: asyncio.StreamWriter) -> None:
+    """
+    Обслуживает соединение: разбирает запросы HTTP/1.1
+    и отвечает на них, пока клиент не закроет соединение.
+    """
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+
+            except ValueError as e:
+                # Где начинается следующий запрос, неизвестно,
+                # поэтому после ответа соединение закрывается
+                await _respond(writer, 400, str(e).encode(),
+                               {"Connection": "close"})
+                break
+
+            if request is None:
+                break
+
+            verb, target, headers, body = request
+            extra = {}
+
+            try:
+                url = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(url.query)
+
+                if url.path == "/metrics" and verb == "GET":
+                    payload, extra = _metrics(query)
+                    status = 200
+
+                elif verb != "POST":
+                    status, payload = 405, b""
+
+                else:
+                    payload, extra = await _route(service, url.path, query,
+                                                  headers, body)
+                    status = 200
+
+            except LookupError as e:
+                status, payload = 404, str(e).encode()
+
+            except ValueError as e:
+                status, payload = 400, str(e).encode()
+
+            except Exception as e:
+                status, payload = 500, f"{type(e).__name__}: {e}".encode()
+
+            await _respond(writer, status, payload, extra)
+
+            if headers.get("connection", "").lower() == "close":
+                break
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080,
+                cpu_workers: int = None, io_workers: int = None,
+                max_pending: int = None) -> None:
+    """
+    Запускает локальный HTTP сервер поверх сервиса.
+    """
+    async with Service(cpu_workers, io_workers, max_pending) as service:
+        server = await asyncio.start_server(
+            lambda r, w: _handle(service, r, w), host, port)
+
+        async with server:
+            print(f"Serving on http://{host}:{port}")
+            await server.serve_forever()
+
+
+def main() -> None:
+    """
+    Запускает локальный сервер встраивания и извлечения
+    сообщений для нагрузочного тестирования.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cpu-workers", type=int)
+    parser.add_argument("--io-workers", type=int)
+    parser.add_argument("--max-pending", type=int)
+    parser.add_argument("--metrics", action="store_true",
+                        help="собирать статистику для GET /metrics")
+    args = parser.parse_args()
+
+    if args.metrics:
+        instrument.enable()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.cpu_workers,
+                          args.io_workers, args.max_pending))
+
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
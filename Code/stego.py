@@ -0,0 +1,236 @@
+import argparse
+import os
+import shutil
+import sys
+import coders
+import instrument
+
+# Модули методов, numpy, jpegio, PIL и OpenCV импортируются только
+# внутри подкоманд, которым они нужны: короткий запуск не тратит
+# время на загрузку библиотек, которые не будут использованы.
+
+# Расширения изображений, собираемых из каталогов для анализа корпуса
+IMAGES = (".png", ".jpg", ".jpeg", ".bmp", ".ppm", ".pgm", ".tif", ".tiff")
+
+
+def _options(args) -> dict:
+    """
+    Возвращает параметры кодера, заданные в командной строке.
+    """
+    # Передаются только заданные параметры, а принимает ли их
+    # метод, проверяется в main
+    options = {"bits": args.bits, "seed": args.seed}
+    return {k: v for k, v in options.items() if v is not None}
+
+
+def _embed(args) -> None:
+    """
+    Встраивает сообщение с заголовком в контейнер.
+    """
+    if args.text is not None:
+        message = args.text.encode()
+
+    else:
+        with open(args.message, "rb") as f:
+            message = f.read()
+
+    coder = coders.load(args.method)
+
+    # Raw изменяет файл на месте, поэтому кодируем копию
+    if args.method == "raw":
+        shutil.copyfile(args.container, args.output)
+        stego = coder(args.output, message, **_options(args))
+        stego.encode_framed()
+        stego.save()
+        return
+
+    stego = coder(args.container, message, **_options(args))
+    positions = coders.encode_framed(args.method, stego)
+    stego.save_as(args.output)
+
+    # Метод BMYY возвращает позиции блоков, они нужны для извлечения
+    if positions is not None:
+        with open(args.output + ".positions", "wb") as f:
+            f.write(positions)
+
+
+def _extract(args) -> None:
+    """
+    Извлекает сообщение с заголовком из контейнера.
+    """
+    stego = coders.reader(args.method)(args.container, **_options(args))
+
+    positions = None
+
+    if coders.positional(args.method):
+        with open(args.positions or args.container + ".positions",
+                  "rb") as f:
+            positions = f.read()
+
+    message = coders.decode_framed(args.method, stego, positions)
+
+    if args.out is None:
+        sys.stdout.buffer.write(message)
+
+    else:
+        with open(args.out, "wb") as f:
+            f.write(message)
+
+
+def _chi(args) -> None:
+    """
+    Выполняет атаку хи-квадрат для каждого файла.
+    """
+    import chi
+
+    exclude = tuple(int(v) for v in args.exclude.split(",") if v)
+
+    for file_name in args.files:
+        if args.curve:
+            curve = chi.chi_curve(file_name, args.curve, args.channel,
+                                  exclude)
+            print(file_name, " ".join(f"{p:.4f}" for p in curve))
+
+        else:
+            p = chi.chi_attack(file_name, args.channel, exclude)
+            print(f"{file_name} {p:.6f}")
+
+
+def _correlation(args) -> None:
+    """
+    Выводит статистику совпадения младших бит соседних пикселей.
+    """
+    import lsb_correlation
+
+    for file_name in args.images:
+        image = lsb_correlation.read_gray(file_name)
+        lsb_correlation.pretty_stat(
+            lsb_correlation.lsb_comparison(image), file_name)
+
+
+def _corpus(args) -> None:
+    """
+    Считает статистику младших бит для корпуса изображений.
+    """
+    import numpy as np
+    import lsb_correlation
+
+    files = []
+
+    for source in args.sources:
+        if os.path.isdir(source):
+            files += sorted(os.path.join(source, name)
+                            for name in os.listdir(source)
+                            if name.lower().endswith(IMAGES))
+
+        else:
+            files.append(source)
+
+    stats = lsb_correlation.analyze(files, args.workers, args.thumbnails,
+                                    args.scale)
+
+    for row in stats:
+        print(f"{row['file']} {row['horizontal']:.4f} "
+              f"{row['vertical']:.4f}")
+
+    if args.out is not None:
+        np.save(args.out, stats)
+
+
+def _lsb_plane(args) -> None:
+    """
+    Сохраняет плоскость младших бит изображения.
+    """
+    import lsb_correlation
+    import visual_lsb
+
+    image = lsb_correlation.read_gray(args.image)
+    visual_lsb.save_gray(visual_lsb.lsb_plane(image), args.output)
+
+
+def main() -> None:
+    """
+    Единая точка входа: встраивание, извлечение и анализ.
+    """
+    parser = argparse.ArgumentParser(prog="stego", description=main.__doc__)
+    parser.add_argument("--metrics", choices=("json", "prometheus"),
+                        help="вывести статистику instrument в stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+    methods = sorted(coders.CODERS)
+
+    embed = commands.add_parser("embed", help="встроить сообщение")
+    embed.add_argument("method", choices=methods)
+    embed.add_argument("container")
+    embed.add_argument("output")
+    embed.add_argument("--bits", type=int,
+                       help="число младших бит элемента для методов LSB")
+    embed.add_argument("--seed", type=int,
+                       help="ключ рассеивания сообщения для методов LSB")
+    source = embed.add_mutually_exclusive_group(required=True)
+    source.add_argument("--message", help="файл сообщения")
+    source.add_argument("--text", help="сообщение строкой")
+    embed.set_defaults(handler=_embed)
+
+    extract = commands.add_parser("extract", help="извлечь сообщение")
+    extract.add_argument("method", choices=methods)
+    extract.add_argument("container")
+    extract.add_argument("--bits", type=int,
+                         help="число младших бит элемента для методов LSB")
+    extract.add_argument("--seed", type=int,
+                         help="ключ рассеивания сообщения для методов LSB")
+    extract.add_argument("--positions", help="файл позиций для BMYY")
+    extract.add_argument("--out", help="файл сообщения, иначе stdout")
+    extract.set_defaults(handler=_extract)
+
+    chi = commands.add_parser("chi", help="атака хи-квадрат")
+    chi.add_argument("files", nargs="+")
+    chi.add_argument("--curve", type=int, default=0,
+                     help="число точек последовательной атаки")
+    chi.add_argument("--channel", type=int, default=1)
+    chi.add_argument("--exclude", default="",
+                     help="исключаемые значения через запятую")
+    chi.set_defaults(handler=_chi)
+
+    correlation = commands.add_parser(
+        "correlation", help="корреляция младших бит соседних пикселей")
+    correlation.add_argument("images", nargs="+")
+    correlation.set_defaults(handler=_correlation)
+
+    corpus = commands.add_parser(
+        "corpus", help="статистика младших бит корпуса изображений")
+    corpus.add_argument("sources", nargs="+", help="изображения и каталоги")
+    corpus.add_argument("--workers", type=int)
+    corpus.add_argument("--thumbnails", help="каталог уменьшенных плоскостей")
+    corpus.add_argument("--scale", type=int, default=8)
+    corpus.add_argument("--out", help="файл .npy со структурированным массивом")
+    corpus.set_defaults(handler=_corpus)
+
+    plane = commands.add_parser("lsb-plane",
+                                help="изображение плоскости младших бит")
+    plane.add_argument("image")
+    plane.add_argument("output")
+    plane.set_defaults(handler=_lsb_plane)
+
+    args = parser.parse_args()
+
+    if args.command in ("embed", "extract"):
+        try:
+            coders.check_options(args.method, _options(args))
+
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.metrics is not None:
+        instrument.enable()
+
+    args.handler(args)
+
+    # Статистику и профиль (STEGO_INSTRUMENT=profile) выводим
+    # в stderr: в stdout может идти извлеченное сообщение
+    if args.metrics is not None:
+        sys.stderr.write(instrument.export(args.metrics))
+        sys.stderr.write(instrument.profile())
+
+
+if __name__ == "__main__":
+    main()
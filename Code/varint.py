@@ -0,0 +1,56 @@
+import numpy as np
+
+# Наибольшее число байт в записи 64-битного числа
+MAX_BYTES = 10
+
+
+def encode(values: np.array) -> bytes:
+    """
+    Записывает неотрицательные числа values в формате varint
+    (LEB128): по 7 бит в байте, начиная с младших, старший бит
+    байта означает, что запись числа продолжается.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    # Число байт записи каждого числа
+    sizes = np.ones(len(values), dtype=np.intp)
+
+    for k in range(1, MAX_BYTES):
+        sizes += values >= np.uint64(1 << (7 * k))
+
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    out = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+
+    # Байты с одинаковым номером k в записи числа
+    # формируются сразу для всех чисел
+    for k in range(int(sizes.max(initial=0))):
+        selected = np.flatnonzero(sizes > k)
+        part = (values[selected] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = np.where(sizes[selected] > k + 1, 0x80, 0)
+        out[starts[selected] + k] = part.astype(np.uint8) | more
+
+    return out.tobytes()
+
+
+def decode(data, count: int = None) -> np.array:
+    """
+    Читает числа в формате varint из data. Если задано count,
+    читаются только первые count чисел.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80) + 1
+
+    if count is not None:
+        ends = ends[:count]
+
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    data = data[:ends[-1]]
+    starts = np.concatenate([[0], ends[:-1]])
+    # Номер каждого байта внутри записи своего числа
+    shift = np.arange(len(data)) - np.repeat(starts, ends - starts)
+    part = (data & 0x7F).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    # Биты разных байт записи не пересекаются, поэтому
+    # их можно сложить вместо побитового ИЛИ
+    return np.add.reduceat(part, starts)
@@ -0,0 +1,330 @@
+import argparse
+import functools
+import io
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import bench
+import coders
+import frame
+
+# Размеры синтетических контейнеров: высота и ширина. Размеры,
+# не кратные 8, проверяют неполные блоки по краям изображения
+SIZES = ("64x96", "136x200", "263x352")
+
+# BMYY встраивает по биту в подходящий блок яркости, и в
+# контейнеры меньше 263x352 не помещается даже заголовок
+BMYY_SIZES = ("263x352", "520x776")
+
+# Размеры сообщений: в байтах, в процентах от емкости или
+# "over" - на байт больше емкости, встраивание должно отказать
+MESSAGES = ("0", "1", "10%", "100%", "over")
+
+# Качество JPEG, с которым пересжимаются контейнеры BMYY
+QUALITIES = (95, 85, 75)
+
+# Допустимая доля ошибочных бит BMYY после пересжатия по
+# умолчанию. При качестве 95 блоки яркости не теряют ни бита,
+# а каналы цветности - доли процента
+MAX_BER = {95: 0.02}
+
+# Качество исходных JPEG контейнеров
+QUALITY = 90
+
+# Вместо SEED в параметры кодера подставляется ключ варианта
+SEED = "seed"
+
+# Проверяемые варианты: метод и параметры кодера. Параметр
+# key - формат ключа позиций BMYY, он передается в encode_framed
+VARIANTS = (
+    ("png", {}),
+    ("png", {"bits": 3, "seed": SEED}),
+    ("png-blue", {"bits": 2}),
+    ("jsteg", {}),
+    ("jsteg", {"seed": SEED}),
+    ("jsteg-skip", {}),
+    ("bmyy", {"seed": SEED}),
+    ("bmyy", {"seed": SEED, "compat": True, "key": "used"}),
+    ("bmyy", {"seed": SEED, "channels": (0, 1, 2), "Pl": (210, 20, 20),
+              "key": "runs"}),
+)
+
+
+@functools.lru_cache(maxsize=16)
+def make_bytes(fmt: str, h: int, w: int, seed: int,
+               quality: int = QUALITY) -> bytes:
+    """
+    Возвращает байты синтетического контейнера h x w в формате
+    fmt ("png" или "jpg"). Файлы не создаются, а в каждом процессе
+    контейнер создается один раз для всех вариантов.
+    """
+    from PIL import Image
+
+    image = Image.fromarray(bench.make_container(h, w, seed))
+    out = io.BytesIO()
+
+    if fmt == "png":
+        image.save(out, "PNG", compress_level=1)
+
+    else:
+        image.save(out, "JPEG", quality=quality)
+
+    return out.getvalue()
+
+
+def recompress(data: bytes, quality: int) -> bytes:
+    """
+    Распаковывает JPEG в пиксели и сжимает заново
+    с качеством quality, как при пересылке изображения.
+    """
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _update(stego, method: str, positions: bytes, key: str) -> None:
+    """
+    Обновляет уже встроенное сообщение с заголовком.
+    """
+    if coders.positional(method):
+        coders.encode_framed(method, stego, positions, key)
+
+    else:
+        stego.encode_framed(update=True)
+
+
+def _bit_errors(decoded: bytes, expected: bytes) -> float:
+    """
+    Возвращает долю отличающихся бит.
+    """
+    a = np.unpackbits(np.frombuffer(decoded, np.uint8))
+    b = np.unpackbits(np.frombuffer(expected, np.uint8))
+    return np.count_nonzero(a != b) / max(len(b), 1)
+
+
+def round_trip(method: str, options: dict, h: int, w: int, seed: int,
+               spec: str, qualities: tuple = QUALITIES) -> dict:
+    """
+    Проверяет вариант на синтетическом контейнере: встраивание,
+    извлечение из байт результата и обновление сообщения, а для
+    BMYY - долю ошибочных бит после пересжатия с качеством
+    qualities. Возвращает запись с состоянием "ok", "fail" или
+    "skip" (в контейнер не помещается даже заголовок).
+    """
+    options = dict(options)
+    key = options.pop("key", "auto")
+    fmt = "png" if ".png" in coders.CODERS[method][3] else "jpg"
+    data = make_bytes(fmt, h, w, seed)
+    record = {"status": "ok", "detail": "", "ber": {}}
+
+    stego = coders.from_bytes(method, data, **options)
+    capacity = stego.capacity() - frame.HEADER_SIZE
+
+    if capacity < 0:
+        return dict(record, status="skip", detail="емкость меньше заголовка")
+
+    rng = np.random.default_rng(seed)
+
+    if spec == "over":
+        stego.message = rng.bytes(capacity + 1)
+
+        try:
+            coders.encode_framed(method, stego, key=key)
+
+        except ValueError:
+            return record
+
+        return dict(record, status="fail",
+                    detail="встроено сообщение больше емкости")
+
+    n = frame.message_size(spec, stego.capacity())
+    message, other = rng.bytes(n), rng.bytes(n)
+    stego.message = message
+    positions = coders.encode_framed(method, stego, key=key)
+    result = stego.to_bytes()
+
+    decoded = coders.decode_framed(
+        method, coders.from_bytes(method, result, **options), positions)
+
+    if decoded != message:
+        return dict(record, status="fail", detail="извлечение")
+
+    # Обновляем сообщение в уже заполненном контейнере
+    stego = coders.from_bytes(method, result, other, **options)
+    _update(stego, method, positions, key)
+    decoded = coders.decode_framed(
+        method, coders.from_bytes(method, stego.to_bytes(), **options),
+        positions)
+
+    if decoded != other:
+        return dict(record, status="fail", detail="обновление")
+
+    if coders.positional(method):
+        # Пересжатие меняет коэффициенты, поэтому сравниваем
+        # биты, а не требуем точного извлечения сообщения
+        expected = frame.pack(message)
+
+        for quality in qualities:
+            stego = coders.from_bytes(method, recompress(result, quality),
+                                      **options)
+            decoded = stego.decode(positions, len(expected))
+            record["ber"][quality] = _bit_errors(decoded, expected)
+
+    return record
+
+
+def _run(case: tuple) -> dict:
+    """
+    Выполняет round_trip для случая case в процессе-исполнителе.
+    Исключение кодера не останавливает проверку, а
+    записывается как ошибка случая.
+    """
+    try:
+        return round_trip(*case)
+
+    except Exception as e:
+        return {"status": "fail", "detail": f"{type(e).__name__}: {e}",
+                "ber": {}}
+
+
+def _variant(method: str, options: dict) -> str:
+    """
+    Возвращает описание варианта без пробелов. Ключ
+    указывается только наличием: он свой у каждого случая.
+    """
+    params = ",".join(k if k == "seed" else f"{k}={v}"
+                      for k, v in options.items())
+    return f"{method}[{params}]".replace(" ", "")
+
+
+def _label(method: str, options: dict, h: int, w: int, seed: int,
+           spec: str, *_) -> str:
+    """
+    Возвращает описание случая для вывода.
+    """
+    return f"{_variant(method, options)} {h}x{w} seed={seed} msg={spec}"
+
+
+def cases(methods: list, sizes: list, seeds: int, messages: list,
+          qualities: tuple = QUALITIES) -> list:
+    """
+    Возвращает все сочетания вариантов методов methods, размеров
+    sizes, seeds ключей и размеров сообщений messages. Если
+    sizes не заданы, BMYY проверяется на размерах BMYY_SIZES,
+    остальные методы - на SIZES.
+    """
+    result = []
+
+    for method, options in VARIANTS:
+        if method not in methods:
+            continue
+
+        if sizes:
+            variant_sizes = sizes
+
+        else:
+            variant_sizes = BMYY_SIZES if coders.positional(method) else SIZES
+
+        for size, seed, spec in itertools.product(
+                variant_sizes, range(seeds), messages):
+            h, w = (int(v) for v in size.split("x"))
+            params = {k: seed if v == SEED else v
+                      for k, v in options.items()}
+            result.append((method, params, h, w, seed, spec,
+                           tuple(qualities)))
+
+    return result
+
+
+def run(all_cases: list, workers: int = None) -> list:
+    """
+    Выполняет случаи в пуле процессов и возвращает
+    их записи в том же порядке.
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        # Соседние случаи используют один контейнер, поэтому
+        # раздаем их пачками: контейнер создается реже
+        chunk = max(1, len(all_cases) // (4 * (workers or os.cpu_count())))
+        return list(pool.map(_run, all_cases, chunksize=chunk))
+
+
+def main() -> None:
+    """
+    Проверяет встраивание и извлечение всеми методами на
+    синтетических контейнерах разных размеров, ключей и
+    размеров сообщений, а также устойчивость BMYY к пересжатию.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--methods",
+                        default=",".join(dict.fromkeys(m for m, _ in VARIANTS)))
+    parser.add_argument("--sizes", default="",
+                        help="размеры через запятую, например 64x96; "
+                             "по умолчанию свои для BMYY и для LSB")
+    parser.add_argument("--seeds", type=int, default=3,
+                        help="число ключей и контейнеров на размер")
+    parser.add_argument("--messages", default=",".join(MESSAGES),
+                        help="размеры сообщений: байты, проценты или over")
+    parser.add_argument("--qualities",
+                        default=",".join(str(q) for q in QUALITIES),
+                        help="качество пересжатия JPEG для BMYY")
+    parser.add_argument("--max-ber", type=float,
+                        help="допустимая доля ошибочных бит после пересжатия "
+                             "при любом качестве, по умолчанию - MAX_BER")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    qualities = tuple(int(q) for q in args.qualities.split(",") if q)
+    sizes = [size for size in args.sizes.split(",") if size]
+    all_cases = cases(args.methods.split(","), sizes, args.seeds,
+                      args.messages.split(","), qualities)
+    start = time.perf_counter()
+    records = run(all_cases, args.workers)
+    elapsed = time.perf_counter() - start
+    ber = {}
+    groups = {}
+
+    for case, record in zip(all_cases, records):
+        label = _label(*case)
+        bound = MAX_BER if args.max_ber is None else {}
+
+        for quality, value in record["ber"].items():
+            ber.setdefault((_variant(*case[:2]), quality), []).append(value)
+            limit = bound.get(quality, args.max_ber)
+
+            if limit is not None and value > limit:
+                record["status"] = "fail"
+                record["detail"] = f"BER {value:.3f} при качестве {quality}"
+
+        if record["status"] == "fail":
+            print(f"FAIL {label}: {record['detail']}")
+
+        group = f"{_variant(*case[:2])} {case[2]}x{case[3]}"
+        groups.setdefault(group, []).append(record["status"])
+
+    # Вариант, пропущенный на всем размере, ничего не проверяет
+    empty = [group for group, statuses in groups.items()
+             if set(statuses) == {"skip"}]
+
+    for group in empty:
+        print(f"FAIL {group}: пропущены все случаи")
+
+    for (variant, quality), values in ber.items():
+        print(f"{variant:>40} q={quality:<3} BER "
+              f"mean {np.mean(values):.4f} max {np.max(values):.4f}")
+
+    status = [record["status"] for record in records]
+    print(f"{len(records)} cases in {elapsed:.1f} s: "
+          f"{status.count('ok')} ok, {status.count('fail')} failed, "
+          f"{status.count('skip')} skipped")
+
+    if "fail" in status or empty:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
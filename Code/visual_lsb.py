@@ -1,5 +1,49 @@
 import numpy as np
-import cv2
+from lsb_correlation import read_gray
+
+
+def lsb_plane(image: np.array) -> np.array:
+    """
+    Возвращает плоскость наименее значащих бит изображения.
+    Для контрастности значения умножены на 255,
+    таким образом в матрице будут лишь значения 0 и 255.
+    """
+    return (image & 1) * 255
+
+
+def lsb_thumbnail(image: np.array, scale: int = 8,
+                  plane: int = 0) -> np.array:
+    """
+    Возвращает уменьшенную в scale раз битовую плоскость plane
+    изображения: каждый пиксель - доля единиц в блоке scale x scale,
+    умноженная на 255. Области с постоянным битом остаются черными
+    или белыми, шумоподобные - серыми. Каналы сохраняются.
+    """
+    h, w = image.shape[0] // scale * scale, image.shape[1] // scale * scale
+    bits = (image[:h, :w] >> plane) & 1
+    # Блоки суммируются через представление без копирования
+    blocks = bits.reshape(h // scale, scale, w // scale, scale,
+                          *image.shape[2:])
+    total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    return (total * 255 // (scale * scale)).astype(np.uint8)
+
+
+def save_thumbnail(image: np.array, file_name: str) -> None:
+    """
+    Сохраняет уменьшенную плоскость в файл PNG.
+    """
+    from PIL import Image
+
+    Image.fromarray(image).save(file_name, format="PNG")
+
+
+def save_gray(image: np.array, file_name: str) -> None:
+    """
+    Сохраняет матрицу в файл как изображение в градациях серого.
+    """
+    import cv2
+
+    cv2.imwrite(file_name, image)
 
 
 def main() -> None:
@@ -7,17 +51,15 @@ def main() -> None:
     Проверяет работоспособность программы.
     """
     # Считаем синий канал оригинала
-    blue_original = cv2.imread("Images/Lenna.png", 0)
+    blue_original = read_gray("Images/Lenna.png")
     # Считаем синий канал модифицированного сообщения
-    blue_stego = cv2.imread("Images/LSB_Lenna.png", 0)
+    blue_stego = read_gray("Images/LSB_Lenna.png")
     # Получим только последний бит.
-    # Для контрастности умножим полученное значение на 255,
-    # таким образом в матрицу будут лишь значения 0 и 255.
-    bw_original = (blue_original & 1) * 255
-    bw_stego = (blue_stego & 1) * 255
+    bw_original = lsb_plane(blue_original)
+    bw_stego = lsb_plane(blue_stego)
     # Сохраним полученные изображения в градации серого.
-    cv2.imwrite("Images/BW_Lenna.png", bw_original)
-    cv2.imwrite("Images/BW_LSB_Lenna.png", bw_stego)
+    save_gray(bw_original, "Images/BW_Lenna.png")
+    save_gray(bw_stego, "Images/BW_LSB_Lenna.png")
 
 
 if __name__ == "__main__":